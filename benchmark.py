@@ -0,0 +1,164 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tracemalloc
+from time import perf_counter
+import numpy as np
+from scenes import SCENES
+
+# Headless benchmark suite built from the example scenes. Every case builds a
+# scene, times a fixed number of steps per integrator and reports
+#   steps_per_second      after one untimed warm-up step
+#   bytes_per_particle    peak traced allocation while building and stepping
+#   energy_drift          max |E - E0| / |E0| over the run (kinetic, springs
+#                         and the batched fields that provide energy())
+# as one JSON object per line (on stdout, or in --output) tagged with the git
+# commit, so that runs on different commits can be compared with --compare.
+#
+#   python benchmark.py --quick
+#   python benchmark.py --output base.jsonl
+#   python benchmark.py --compare base.jsonl --filter wave
+
+# name -> (scene, builder arguments, steps, included in --quick)
+CASES = {
+    'wave-30': ('wave', {'nx': 30, 'ny': 30}, 2000, True),
+    'wave-100': ('wave', {'nx': 100, 'ny': 100}, 500, True),
+    'wave-300': ('wave', {'nx': 300, 'ny': 300}, 50, False),
+    'wave-500': ('wave', {'nx': 500, 'ny': 500}, 20, False),
+    'coulomb': ('coulomb', {}, 5000, True),
+    'nbody-1000': ('nbody', {'n': 1000}, 50, True),
+    'nbody-10000': ('nbody', {'n': 10000}, 5, False),
+    'gyroscope': ('gyroscope', {}, 5000, True),
+    'cube': ('cube', {}, 5000, True),
+}
+INTEGRATORS = ('euler', 'leapfrog', 'rk4')
+SAMPLES = 20  # energy evaluations per run
+DISSIPATIVE = {'cube'}  # damped scenes, whose drift is the energy lost
+
+def total_energy(sim):
+    return sum(sim.get_energy()) + sim.get_field_energy()
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor() or None,
+    }
+
+# Runs one case with one integrator and returns its result dict
+def run(name, integrator, steps=None):
+    scene, params, default_steps, _ = CASES[name]
+    steps = default_steps if steps is None else steps
+    builder = SCENES[scene]
+
+    tracemalloc.start()
+    sim = builder(integrator=integrator, **params)
+    sim.update()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    sim = builder(integrator=integrator, **params)
+    e0 = total_energy(sim)
+    drift = 0.0
+    sim.update()
+    every = max(1, steps // SAMPLES)
+    elapsed = 0.0
+    done = 0
+    with np.errstate(all='ignore'):
+        while done < steps:
+            n = min(every, steps - done)
+            start = perf_counter()
+            sim.run(n)
+            elapsed += perf_counter() - start
+            done += n
+            drift = max(drift, abs(total_energy(sim) - e0) / abs(e0))
+    return {
+        'case': name,
+        'scene': scene,
+        'params': params,
+        'integrator': integrator,
+        'particles': sim.state.count,
+        'springs': sim.spring_state.count,
+        'steps': steps,
+        'seconds': elapsed,
+        'steps_per_second': steps / elapsed,
+        'bytes_per_particle': peak / sim.state.count,
+        'energy_drift': drift if np.isfinite(drift) else None,
+        'dissipative': scene in DISSIPATIVE,
+    }
+
+# Runs the selected cases and yields one result per (case, integrator)
+def benchmark(cases=None, integrators=INTEGRATORS, quick=False, steps=None):
+    env = environment()
+    if cases is None:
+        cases = [name for name, case in CASES.items() if case[3] or not quick]
+    for name in cases:
+        for integrator in integrators:
+            result = run(name, integrator, steps)
+            result.update(env)
+            yield result
+
+def load(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+# Relative change in steps/sec of every (case, integrator) also in `baseline`;
+# slowdowns beyond `threshold` are flagged as regressions
+def compare(results, baseline, threshold=0.1):
+    base = {(r['case'], r['integrator']): r for r in baseline}
+    rows = []
+    for r in results:
+        b = base.get((r['case'], r['integrator']))
+        if b is not None:
+            change = r['steps_per_second'] / b['steps_per_second'] - 1
+            rows.append((r['case'], r['integrator'], b['steps_per_second'], r['steps_per_second'], change,
+                         change < -threshold))
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Headless benchmarks of the example scenes')
+    parser.add_argument('--quick', action='store_true', help='small cases only')
+    parser.add_argument('--filter', default='', help='run the cases whose name contains this string')
+    parser.add_argument('--integrators', default=','.join(INTEGRATORS), help='comma-separated integrator names')
+    parser.add_argument('--steps', type=int, help='override the number of steps of every case')
+    parser.add_argument('--output', help='write the results to this JSON lines file instead of stdout')
+    parser.add_argument('--compare', help='JSON lines file of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1, help='slowdown reported as a regression')
+    args = parser.parse_args(argv)
+
+    cases = [name for name, case in CASES.items() if args.filter in name and (case[3] or not args.quick)]
+    out = open(args.output, 'w') if args.output else sys.stdout
+    results = []
+    try:
+        for result in benchmark(cases, args.integrators.split(','), steps=args.steps):
+            results.append(result)
+            drift = result['energy_drift']
+            print(f"{result['case']:12} {result['integrator']:10} {result['particles']:7d} particles "
+                  f"{result['steps_per_second']:10.1f} steps/s {result['bytes_per_particle']:8.0f} B/particle "
+                  f"drift {'nan' if drift is None else f'{drift:.1e}'}", file=sys.stderr)
+            out.write(json.dumps(result) + '\n')
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    if args.compare:
+        rows = compare(results, load(args.compare), args.threshold)
+        for case, integrator, before, after, change, regression in rows:
+            print(f"{case:12} {integrator:10} {before:10.1f} -> {after:10.1f} steps/s {change:+7.1%}"
+                  f"{'  REGRESSION' if regression else ''}", file=sys.stderr)
+        return 1 if any(row[-1] for row in rows) else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
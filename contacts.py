@@ -0,0 +1,177 @@
+import numpy as np
+from physics import scatter_add
+from interactions import _expand
+
+# Contact handling for spherical particles: soft (penalty) sphere-sphere and
+# sphere-plane contacts with restitution and Coulomb friction, used as a
+# batched field. Candidate pairs come from a sweep-and-prune broad phase.
+
+# Sweep and prune over the bounding intervals [x - r, x + r] along one axis.
+# To keep the sweep short in dense 3D piles, particles are bucketed into
+# columns of side 2 max(r) across the other two axes, and each particle is
+# only swept against its own column and the neighbouring ones; the particles
+# are kept sorted by (column, interval start). The order of the previous call
+# is reused and re-sorted with a stable (adaptive merge) sort, which runs in
+# near-linear time when particles moved little, i.e. it exploits temporal
+# coherence. The sweep axis is the longest extent at the first call and
+# whenever the particle count changes.
+class SweepAndPrune:
+    # Neighbouring columns (da, db), half of them so every pair of columns
+    # is swept once
+    NEIGHBORS = ((0, 1), (1, -1), (1, 0), (1, 1))
+
+    def __init__(self):
+        self.order = None
+        self.axis = None
+        self.resorts = 0
+        self.candidates = 0
+
+    def reset(self):
+        self.order = None
+
+    # Pairs (i, j) whose spheres overlap, with the separation vectors
+    # d = pos[j] - pos[i] and distances
+    def pairs(self, pos, radius):
+        n = len(pos)
+        radius = np.broadcast_to(radius, (n,))
+        if n < 2:
+            return np.zeros(0, np.intp), np.zeros(0, np.intp), np.zeros((0, 3)), np.zeros(0)
+        if self.order is None or len(self.order) != n:
+            self.order = None
+            self.axis = int(np.argmax(np.ptp(pos, axis=0)))
+        a, b = [k for k in range(3) if k != self.axis]
+        width = 2 * radius.max()
+        cells = np.floor(pos[:, (a, b)] / width).astype(np.int64)
+        cells -= cells.min(0) - 1
+        rows = cells[:, 1].max() + 2
+        column = cells[:, 0] * rows + cells[:, 1]
+        lo = pos[:, self.axis] - radius
+        hi = pos[:, self.axis] + radius
+        x0 = lo.min()
+        span = hi.max() - x0 + 2 * width + 1.0
+        keys = column * span + (lo - x0)
+
+        if self.order is None:
+            self.order = np.argsort(keys, kind='stable')
+            self.resorts += 1
+        else:
+            self.order = self.order[np.argsort(keys[self.order], kind='stable')]
+        # The sweep and the narrow phase run on the sorted copies, where
+        # partners are close in memory
+        order = self.order
+        sorted_keys = keys[order]
+        c, l, h = column[order], lo[order] - x0, hi[order] - x0
+        p, r = pos[order], radius[order]
+
+        # Own column: the particles after each one up to the end of its interval
+        starts = [np.arange(1, n)]
+        stops = [np.searchsorted(sorted_keys, c * span + h, side='right')[:-1]]
+        owners = [np.arange(n - 1)]
+        for da, db in self.NEIGHBORS:
+            target = (c + da * rows + db) * span
+            starts.append(np.searchsorted(sorted_keys, target + np.maximum(l - width, 0.0), side='left'))
+            stops.append(np.searchsorted(sorted_keys, target + h, side='right'))
+            owners.append(np.arange(n))
+        starts, stops, owners = map(np.concatenate, (starts, stops, owners))
+        counts = np.maximum(stops - starts, 0)
+        i = np.repeat(owners, counts)
+        j = _expand(starts, counts)
+        self.candidates = len(i)
+
+        d = p[j] - p[i]
+        dist = np.sqrt(np.einsum('ij,ij->i', d, d))
+        touching = np.flatnonzero(dist < r[i] + r[j])
+        return order[i[touching]], order[j[touching]], d[touching], dist[touching]
+
+# Half-space boundary through `point` with outward `normal` (particles are
+# kept on the side the normal points to)
+class Plane:
+    def __init__(self, point=(0.0, 0.0, 0.0), normal=(0.0, 0.0, 1.0)):
+        self.point = np.asarray(point, float)
+        self.normal = np.asarray(normal, float) / np.linalg.norm(normal)
+
+# Linear spring-dashpot contacts: at overlap delta the normal force is
+#   F_n = max(k delta - c v_n, 0),   c = 2 zeta sqrt(k m_eff)
+# with v_n the normal relative velocity and zeta chosen so that a head-on
+# collision has the coefficient of `restitution` e,
+#   zeta = -ln e / sqrt(pi^2 + ln^2 e),
+# and the tangential force opposes sliding with magnitude
+#   min(friction F_n, 2 sqrt(k m_eff) |v_t|)
+# (Coulomb friction, made viscous at low sliding speeds). m_eff is the reduced
+# mass for pairs and the particle mass against planes. `radius` is a number or
+# the name of a per-particle property. A contact lasts about pi sqrt(m_eff / k),
+# which dt has to resolve (roughly 20 steps or more).
+class Contacts:
+    def __init__(self, k, radius, restitution=0.5, friction=0.0, planes=(), particles=True):
+        self.k = k
+        self.radius = radius
+        self.restitution = restitution
+        self.friction = friction
+        self.planes = list(planes)
+        self.particles = particles
+        log_e = np.log(restitution) if restitution > 0 else -np.inf
+        self.zeta = 1.0 if restitution <= 0 else -log_e / np.sqrt(np.pi**2 + log_e**2)
+        self.broad = SweepAndPrune()
+        self.count = 0
+        self._members = {}
+
+    def radii(self, mass, properties):
+        if isinstance(self.radius, str):
+            return properties[self.radius]
+        return np.broadcast_to(float(self.radius), mass.shape)
+
+    # Normal and friction forces along the unit normals n for overlaps delta,
+    # relative velocities v (of the far side) and effective masses m
+    def forces(self, n, delta, v, m):
+        v_n = np.einsum('ij,ij->i', v, n)
+        c = 2 * np.sqrt(self.k * m)
+        F_n = np.maximum(self.k * delta - self.zeta * c * v_n, 0.0)
+        F = -F_n[:, None] * n
+        if self.friction:
+            v_t = v - v_n[:, None] * n
+            speed = np.sqrt(np.einsum('ij,ij->i', v_t, v_t))
+            with np.errstate(invalid='ignore', divide='ignore'):
+                f = np.where(speed > 0, np.minimum(self.friction * F_n, c * speed) / speed, 0.0)
+            F += f[:, None] * v_t
+        return F
+
+    def __call__(self, pos, vel, mass, properties, time):
+        if pos.ndim == 3:
+            # Ensemble members one at a time, each with its own broad phase
+            out = []
+            for m in range(len(pos)):
+                self.broad = self._members.setdefault(m, SweepAndPrune())
+                out.append(self(pos[m], vel[m], mass[m], {name: np.broadcast_to(value, mass.shape)[m]
+                                                          for name, value in properties.items()},
+                                time[m] if np.ndim(time) else time))
+            return np.stack(out)
+        r = self.radii(mass, properties)
+        acc = np.zeros_like(pos)
+        self.count = 0
+        if self.particles:
+            i, j, d, dist = self.broad.pairs(pos, r)
+            if len(i):
+                n = d / dist[:, None]
+                F = self.forces(n, r[i] + r[j] - dist, vel[j] - vel[i], mass[i] * mass[j] / (mass[i] + mass[j]))
+                scatter_add(acc, np.concatenate((i, j)), np.concatenate((F / mass[i, None], -F / mass[j, None])))
+                self.count += len(i)
+        for plane in self.planes:
+            delta = r - (pos - plane.point) @ plane.normal
+            i = np.flatnonzero(delta > 0)
+            if len(i):
+                n = np.broadcast_to(-plane.normal, (len(i), 3))
+                F = self.forces(n, delta[i], -vel[i], mass[i])
+                acc[i] += F / mass[i, None]
+                self.count += len(i)
+        return acc
+
+    # Elastic energy stored in the overlaps
+    def energy(self, pos, mass, properties):
+        r = self.radii(mass, properties)
+        overlap = 0.0
+        if self.particles:
+            i, j, d, dist = self.broad.pairs(pos, r)
+            overlap = ((r[i] + r[j] - dist)**2).sum()
+        for plane in self.planes:
+            overlap += (np.maximum(r - (pos - plane.point) @ plane.normal, 0.0)**2).sum()
+        return 0.5 * self.k * overlap
@@ -0,0 +1,167 @@
+from time import perf_counter
+import numpy as np
+from physics import Simulation, SpringState, Implicit, scatter_add
+
+# M copies of one system stepped in lockstep. Positions, velocities and
+# accelerations are (M, N, 3) arrays and masses (M, N); which particles are
+# movable is shared by all members.
+class EnsembleState:
+    def __init__(self, pos, vel, mass, movable):
+        self.pos = pos
+        self.vel = vel
+        self.acc = np.zeros_like(pos)
+        self.mass = mass
+        self.movable = movable
+        self.count = pos.shape[1]
+
+    def __len__(self):
+        return self.count
+
+    def kick(self, dt):
+        if self.movable.all():
+            self.vel += self.acc * dt
+        else:
+            idx = np.flatnonzero(self.movable)
+            self.vel[:, idx] += self.acc[:, idx] * dt
+
+    def drift(self, dt):
+        if self.movable.all():
+            self.pos += self.vel * dt
+        else:
+            idx = np.flatnonzero(self.movable)
+            self.pos[:, idx] += self.vel[:, idx] * dt
+
+def _expand(value, default, shape):
+    return np.array(np.broadcast_to(default if value is None else value, shape), float)
+
+# The springs of a SpringState with (M, S) stiffness and rest length columns.
+# Small networks gather and scatter through a dense (N, S) incidence matrix
+# (+1 at i, -1 at j), whose products beat fancy indexing and bincount over M
+# members.
+class EnsembleSprings:
+    forces = SpringState.forces
+    energy = SpringState.energy
+
+    def __init__(self, springs, members, n, k=None, L0=None):
+        self.count = springs.count
+        self.i = springs.i.copy()
+        self.j = springs.j.copy()
+        self.k = _expand(k, springs.k, (members, self.count))
+        self.L0 = _expand(L0, springs.L0, (members, self.count))
+        self.incidence = None
+        if n * self.count <= 2**16:
+            self.incidence = np.zeros((n, self.count))
+            self.incidence[self.i, np.arange(self.count)] += 1.0
+            self.incidence[self.j, np.arange(self.count)] -= 1.0
+            self.gather = -self.incidence.T.copy()
+
+    def differences(self, x):
+        if self.incidence is None:
+            return x[..., self.j, :] - x[..., self.i, :]
+        return self.gather @ x
+
+# Ensemble of `members` copies of the Simulation `sim`, sharing its particles,
+# springs, batched fields, damping and integrator. Per-member values broadcast
+# against the shapes below and default to the template's:
+#   dt (M,), mass (M, N), position / velocity (M, N, 3), k / L0 (M, S),
+#   properties {name: (M, N)}
+# A per-member dt is kept as an (M, 1, 1) array, as is the time then, so both
+# broadcast against the state arrays. Rods, per-particle fields and the
+# implicit integrators are not supported.
+class Ensemble:
+    def __init__(self, sim, members, dt=None, mass=None, position=None, velocity=None,
+                 k=None, L0=None, properties=None, integrator=None):
+        if sim.rod_state.count:
+            raise ValueError("ensembles do not support rods")
+        if sim.fields:
+            raise ValueError("ensembles only support batched fields")
+        n = sim.state.count
+        shape = (members, n, 3)
+        self.members = members
+        self.state = EnsembleState(_expand(position, sim.state.pos, shape), _expand(velocity, sim.state.vel, shape),
+                                   _expand(mass, sim.state.mass, shape[:2]), sim.state.movable.copy())
+        self.spring_state = EnsembleSprings(sim.spring_state, members, n, k, L0)
+        self.batch_fields = list(sim.batch_fields)
+        self.fields = []
+        self.stats = None
+        self.properties = dict(sim.properties)
+        self.properties.update(properties or {})
+        self.damping = sim.damping
+        self.dissipation_coefficient = sim.dissipation_coefficient
+        dt = sim.dt if dt is None else dt
+        if np.ndim(dt):
+            self.dt = _expand(np.reshape(dt, (-1, 1, 1)), None, (members, 1, 1))
+            self.time = np.full((members, 1, 1), sim.time)
+        else:
+            self.dt = dt
+            self.time = sim.time
+        self.integrator = sim.integrator if integrator is None else integrator
+
+    @property
+    def integrator(self):
+        return self._integrator
+
+    @integrator.setter
+    def integrator(self, value):
+        Simulation.integrator.fset(self, value)
+        if isinstance(self._integrator, Implicit):
+            raise ValueError("ensembles do not support the implicit integrators")
+
+    add_batch_field = Simulation.add_batch_field
+    update_batch_fields = Simulation.update_batch_fields
+    compute_accelerations = Simulation.compute_accelerations
+    force_groups = Simulation.force_groups
+    _timed_accelerations = Simulation._timed_accelerations
+    profile = Simulation.profile
+    run = Simulation.run
+
+    def update_springs(self):
+        springs = self.spring_state
+        if not springs.count:
+            return
+        state = self.state
+        b = self.dissipation_coefficient if self.damping else None
+        F = springs.forces(state.pos, state.vel, b)
+        if springs.incidence is not None:
+            force = springs.incidence @ F
+        else:
+            force = np.zeros_like(state.acc)
+            scatter_add(force, np.concatenate((springs.i, springs.j)), np.concatenate((F, -F), axis=1))
+        state.acc += force / state.mass[..., None]
+
+    def step(self, dt):
+        self._integrator.step(self, dt)
+
+    def update(self):
+        if self.stats is None:
+            self.step(self.dt)
+            return
+        start = perf_counter()
+        self.step(self.dt)
+        self.stats.steps += 1
+        self.stats.add('step', perf_counter() - start)
+
+    # With a per-member dt every member takes as many steps as it needs to
+    # reach t and then idles (steps with dt = 0) until the others are done
+    def run_until(self, t, callback=None, every=1):
+        n_steps = np.maximum(0, np.ceil((t - self.time) / self.dt - 1e-9)).astype(int)
+        if not np.ndim(n_steps):
+            return self.run(int(n_steps), callback, every)
+        dt = self.dt
+        steps = 0
+        try:
+            while steps < n_steps.max():
+                steps += 1
+                self.dt = np.where(n_steps >= steps, dt, 0.0)
+                self.update()
+                if callback is not None and steps % every == 0 and callback(self):
+                    break
+        finally:
+            self.dt = dt
+        return steps
+
+    # Kinetic and spring energies per member, as two (M,) arrays
+    def get_energy(self):
+        state = self.state
+        kinetic = 0.5 * (state.mass * np.einsum('mij,mij->mi', state.vel, state.vel)).sum(-1)
+        return (kinetic, self.spring_state.energy(state.pos))
@@ -2,6 +2,7 @@
 # Imports
 # =======================================================
 from physics import *
+from interactions import Coulomb
 from visualization import *
 import numpy as np
 
@@ -25,43 +26,21 @@ VEL2 = (-0.5, 1.0, 0.0)
 POS3 = (3.0, 1.0, 0.0)
 VEL3 = (-0.5, -1.0, 0.0)
 
-# =======================================================
-# Extend Particle class with 'charge' attribute
-# =======================================================
-setattr(Particle, "charge", 0)
-
 # =======================================================
 # Simulation Setup
 # =======================================================
 sim = Simulation(dt=DT)
 
-
-def coulomb(particle):
-    """
-    Acceleration on `particle` due to Coulomb forces from all other
-    particles in the simulation.  Uses inverse-square law in 3-D.
-    """
-    acc = np.zeros(3)
-    for other in sim.particles:
-        if other is particle:
-            continue
-        r = particle.pos - other.pos
-        acc += (K_COULOMB * particle.charge * other.charge
-                / (particle.mass * vnorm(r) ** 3)) * r
-    return acc
-
-
-sim.add_field(coulomb)
+# Pairwise inverse-square force, with charges read from sim.properties['charge']
+sim.add_batch_field(Coulomb(k=K_COULOMB))
+sim.add_property('charge', float, 0.0)  # one column, so p1.charge reads the array
 
 # =======================================================
 # Particle Creation
 # =======================================================
-p1 = sim.add_particle(mass=M1, position=POS1, velocity=VEL1)
-p1.charge = C1
-p2 = sim.add_particle(mass=M2, position=POS2, velocity=VEL2)
-p2.charge = C2
-p3 = sim.add_particle(mass=M3, position=POS3, velocity=VEL3)
-p3.charge = C3
+p1 = sim.add_particle(mass=M1, position=POS1, velocity=VEL1, properties={'charge': C1})
+p2 = sim.add_particle(mass=M2, position=POS2, velocity=VEL2, properties={'charge': C2})
+p3 = sim.add_particle(mass=M3, position=POS3, velocity=VEL3, properties={'charge': C3})
 
 # =======================================================
 # Visualization
@@ -85,12 +64,9 @@ attach_trail(visual_sim.particles[2], color=color.green, pps=100, retain=100)
 # Main Loop wrapped in play() + Run button
 # =======================================================
 def play():
-    i = 0
     while True:
-        if i % 250 == 0:  # Slow down rendering without missing physics steps
-            visual_sim.update()
-        sim.update()
-        i += 1
+        visual_sim.update()
+        sim.run(250)  # Slow down rendering without missing physics steps
 
 
 # VPython button to start the simulation
@@ -3,8 +3,9 @@
 # =======================================================
 from physics import *
 from visualization import *
-from itertools import product
-from collections import deque
+from recorder import TrajectoryRecorder
+from lattice import grid, spring_network
+import numpy as np
 from vpython import vec, label, graph, gcurve, color, button
 
 # =======================================================
@@ -15,7 +16,7 @@ MASS = 1.0  # mass of every particle
 L = 1.0  # nearest-neighbour spacing
 INIT_V = 3.0  # initial +x velocity of the “kick” particle
 K_SPRING = 500.0  # spring stiffness
-HISTORY_LEN = 1000  # max points in deque/plots
+HISTORY_LEN = 1000  # max points in plots (the recorder keeps the whole run)
 VIS_UPDATE = 10  # physics steps per redraw
 
 # =======================================================
@@ -23,28 +24,21 @@ VIS_UPDATE = 10  # physics steps per redraw
 # =======================================================
 sim = Simulation(dt=DT, damping=True)
 
-particle1 = None  # the particle we kick (+x)
-particle2 = None  # the one directly opposite (–x)
-# (we’ll use their x-velocities for plots)
-
 # -------------------------------------------------------
 # Create 3×3×3 cubic lattice centred at the origin
 # -------------------------------------------------------
-for coord in product((-1, 0, 1), repeat=3):
-    if coord == (-1, 0, 0):
-        particle1 = sim.add_particle(MASS, coord, (INIT_V, 0, 0))
-    elif coord == (1, 0, 0):
-        particle2 = sim.add_particle(MASS, coord)  # at rest
-    else:
-        sim.add_particle(MASS, coord)
+positions = grid((3, 3, 3), L, origin=(-L, -L, -L))
+sim.add_particles(MASS, positions)
+
+particle1 = sim.particles[np.ravel_multi_index((0, 1, 1), (3, 3, 3))]  # the particle we kick (+x)
+particle2 = sim.particles[np.ravel_multi_index((2, 1, 1), (3, 3, 3))]  # the one directly opposite (–x)
+particle1.vel = (INIT_V, 0, 0)
+# (we’ll use their x-velocities for plots)
 
 # -------------------------------------------------------
 # Connect particles whose separation ≤ √2 L (diagonal included)
 # -------------------------------------------------------
-for i, p1 in enumerate(sim.particles[:-1]):
-    for p2 in sim.particles[i + 1:]:
-        if vnorm2(p1.pos - p2.pos) <= 2 * L ** 2:
-            sim.add_spring(p1, p2, K_SPRING)
+sim.add_springs(*spring_network(positions, np.sqrt(2) * L), K_SPRING)
 
 # =======================================================
 # Visualization
@@ -61,13 +55,13 @@ visual_sim = Visualization(
 time_label = label(pixel_pos=True, pos=vec(50, 50, 0))
 
 # =======================================================
-# Graphs & Data Buffers
+# Graphs & Recorder
 # =======================================================
-pot_data = deque(maxlen=HISTORY_LEN)
-kin_data = deque(maxlen=HISTORY_LEN)
-tot_data = deque(maxlen=HISTORY_LEN)
-spd1_data = deque(maxlen=HISTORY_LEN)
-spd2_data = deque(maxlen=HISTORY_LEN)
+# Energies and the x-velocities of the two particles, streamed to disk
+# every redraw
+recorder = sim.add_recorder(TrajectoryRecorder(
+    'cube_vibration_run', every=VIS_UPDATE, fields=('energy',),
+    observables={'speeds': lambda s: (particle1.vel[0], particle2.vel[0])}))
 
 energy_graph = graph(title='Energies', xtitle='Time', ytitle='Energy')
 kin_curve = gcurve(color=color.orange, label='Kinetic', graph=energy_graph)
@@ -83,34 +77,24 @@ spd2_curve = gcurve(color=color.orange, label='Speed 2', graph=speed_graph)
 # Main Loop wrapped in play() + Run button
 # =======================================================
 def play():
-    step = 0
     while True:
-        # -------- per-frame visual & logging --------
-        if step % VIS_UPDATE == 0:
-            visual_sim.update()
-            t = sim.time
-
-            # Energies
-            kin, pot = sim.get_energy()
-            tot = kin + pot
-            kin_data.append((t, kin))
-            pot_data.append((t, pot))
-            tot_data.append((t, tot))
-            kin_curve.data = list(kin_data)
-            pot_curve.data = list(pot_data)
-            tot_curve.data = list(tot_data)
-
-            # Selected particle speeds (x-component)
-            spd1_data.append((t, particle1.vel[0]))
-            spd2_data.append((t, particle2.vel[0]))
-            spd1_curve.data = list(spd1_data)
-            spd2_curve.data = list(spd2_data)
-
-            time_label.text = f'{t:.4f}'
+        # -------- per-frame visual & plots --------
+        visual_sim.update()
+
+        # Last HISTORY_LEN recorded frames
+        t = recorder.read('time', -HISTORY_LEN)
+        kin, pot = recorder.read('energy', -HISTORY_LEN).T
+        spd1, spd2 = recorder.read('speeds', -HISTORY_LEN).T
+        kin_curve.data = np.column_stack((t, kin)).tolist()
+        pot_curve.data = np.column_stack((t, pot)).tolist()
+        tot_curve.data = np.column_stack((t, kin + pot)).tolist()
+        spd1_curve.data = np.column_stack((t, spd1)).tolist()
+        spd2_curve.data = np.column_stack((t, spd2)).tolist()
+
+        time_label.text = f'{sim.time:.4f}'
 
         # -------- physics update --------
-        sim.update()
-        step += 1
+        sim.run(VIS_UPDATE)
 
 
 # VPython button to start the simulation
@@ -2,6 +2,7 @@
 # Imports
 # =======================================================
 from physics import *
+from contacts import Contacts, Plane
 from visualization import *
 
 # =======================================================
@@ -15,6 +16,8 @@ M2 = 2.0  # mass of upper & lower particles
 K_SPRING = 1_000_000  # spring stiffness
 V_Z = 10.0  # initial z-velocity of p4 (and –p5)
 DV_XY = 0.001  # small initial x- & y-velocity components
+K_CONTACT = 1_000_000  # contact stiffness
+RADIUS = 1 / 14  # contact radius of the spheres
 
 # =======================================================
 # Simulation Object & Particles
@@ -59,6 +62,14 @@ sim.add_spring(p3, p5, K_SPRING)
 sim.add_spring(p2, p3, K_SPRING)
 sim.add_spring(p4, p5, K_SPRING)
 
+# =======================================================
+# Contacts
+# =======================================================
+# Solid ground at the top face of the box drawn below (z = -2 D2 + 0.05),
+# and collisions between the spheres
+sim.add_batch_field(Contacts(K_CONTACT, RADIUS, restitution=0.5,
+                             planes=[Plane((0.0, 0.0, -2 * D2 + 0.05))]))
+
 # =======================================================
 # Visualization
 # =======================================================
@@ -85,12 +96,9 @@ attach_trail(visual_sim.particles[1], color=color.green, pps=30, retain=10)
 # Main Loop wrapped in play() + Run button
 # =======================================================
 def play():
-    i = 0
     while True:
-        if i % 250 == 0:
-            visual_sim.update()
-        sim.update()
-        i += 1
+        visual_sim.update()
+        sim.run(250)  # Slow down rendering without missing physics steps
 
 
 # VPython button to start the simulation
@@ -2,6 +2,7 @@
 # Imports
 # =============================
 from physics import *
+from contacts import Contacts, Plane
 from visualization import *
 import numpy as np
 
@@ -15,6 +16,8 @@ MASS = 1.0
 L1 = 3.0
 L2 = 1.0
 G = 9.8
+K_CONTACT = 1_000_000
+RADIUS = 1 / 14
 
 # =============================
 # Simulation Setup
@@ -22,11 +25,11 @@ G = 9.8
 sim = Simulation(dt=DT)
 
 
-def gravity(particle):
-    return np.array([0.0, 0.0, -G])
-
-
-sim.add_field(gravity)
+sim.add_batch_field(uniform_field((0.0, 0.0, -G)))
+# The ground box below is solid: its top face (z = -1.1 L1 + 0.25) stops
+# the spheres if the gyroscope falls
+sim.add_batch_field(Contacts(K_CONTACT, RADIUS, restitution=0.3, friction=0.5,
+                             planes=[Plane((0.0, 0.0, -1.1 * L1 + 0.25))], particles=False))
 
 # =============================
 # Particle Creation
@@ -0,0 +1,49 @@
+# =======================================================
+# Imports
+# =======================================================
+from scenes import SCENES
+import numpy as np
+import time
+
+# =======================================================
+# Parameters
+# =======================================================
+# scene name -> (simulated time, timestep multipliers of the scene's own dt)
+# (T is a multiple of every timestep, so all runs end at the same time)
+RUNS = {
+    'gyroscope': (0.128, (1, 4, 16, 64)),
+    'dzhanibekov': (0.128, (1, 4, 16, 64)),
+    'coulomb': (0.5, (10, 100, 1000)),
+    'cube': (0.96, (1, 4, 16)),
+    'wave': (2.0, (1, 2, 4)),
+}
+SCHEMES = ('euler', 'leapfrog', 'yoshida4', 'rk4')
+REFINE = 4  # reference solution: rk4 at the smallest dt / REFINE
+
+
+def simulate(name, T, dt, integrator):
+    builder = SCENES[name]
+    sim = builder(integrator=integrator)
+    sim.dt = dt
+    start = time.perf_counter()
+    with np.errstate(all='ignore'):
+        steps = sim.run_until(T)
+    return sim, steps, time.perf_counter() - start
+
+
+# =======================================================
+# Accuracy vs. cost table (headless, prints Markdown)
+# =======================================================
+print('| scene | scheme | dt | force evals | time (s) | max position error |')
+print('| --- | --- | --- | --- | --- | --- |')
+for name, (T, multipliers) in RUNS.items():
+    base_dt = SCENES[name]().dt
+    reference = simulate(name, T, base_dt * multipliers[0] / REFINE, 'rk4')[0]
+    for scheme in SCHEMES:
+        for m in multipliers:
+            dt = base_dt * m
+            sim, steps, elapsed = simulate(name, T, dt, scheme)
+            error = np.abs(sim.state.pos - reference.state.pos).max()
+            error = f'{error:.1e}' if np.isfinite(error) and error < 1 else 'unstable'
+            print(f'| {name} | {scheme} | {dt:g} | {steps * sim.integrator.evaluations} '
+                  f'| {elapsed:.2f} | {error} |')
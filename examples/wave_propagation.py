@@ -3,7 +3,9 @@
 # =======================================================
 from physics import *
 from visualization import *
+from lattice import grid, grid_edges, grid_border
 import numpy as np
+import time
 
 # =======================================================
 # Global Parameters
@@ -16,6 +18,8 @@ LY = 3.0  # physical height (physics-y)
 K = 100  # spring stiffness
 MASS = 1.0  # particle mass
 DRIVE_PERIOD = 1.0  # oscillation period for centre node
+FPS = 30  # target redraw rate (physics runs independently)
+SPEED = 1.0  # simulated seconds per wall-clock second
 
 # Derived spacings
 DX = LX / NX
@@ -36,28 +40,20 @@ def idx(i: int, j: int) -> int:
 # -------------------------------------------------------
 # Particle Grid
 # -------------------------------------------------------
-for i in range(NX):
-    for j in range(NY):
-        # Clamp boundary: outer frame is fixed
-        movable = not (i == 0 or j == 0 or i == NX - 1 or j == NY - 1)
-        sim.add_particle(
-            mass=MASS,
-            position=(-LX / 2 + i * DX,  # centre the grid at origin
-                      -LY / 2 + j * DY,
-                      0.0),
-            movable=movable
-        )
+movable = ~grid_border((NX, NY))  # Clamp boundary: outer frame is fixed
+sim.add_particles(
+    MASS,
+    grid((NX, NY), (DX, DY), origin=(-LX / 2, -LY / 2, 0.0)),  # centre the grid at origin
+    movable=movable
+)
 
 # -------------------------------------------------------
 # Springs (horizontal & vertical nearest neighbours)
 # -------------------------------------------------------
-for i in range(NX - 1):
-    for j in range(NY - 1):
-        p1 = sim.particles[idx(i, j)]
-        p2 = sim.particles[idx(i + 1, j)]  # right neighbour
-        p3 = sim.particles[idx(i, j + 1)]  # top neighbour
-        sim.add_spring(p1, p2, K, DX * 0.1)
-        sim.add_spring(p1, p3, K, DY * 0.1)
+i, j = grid_edges((NX, NY))
+keep = movable[i] | movable[j]  # none between two clamped border nodes
+i, j = i[keep], j[keep]
+sim.add_springs(i, j, K, np.where(j - i == 1, DY, DX) * 0.1)  # top / right neighbours
 
 # Centre particle – driven vertically
 middle = sim.particles[idx(NX//2, NY//2)]
@@ -76,20 +72,26 @@ visual_sim = Visualization(
 
 
 # =======================================================
-# Main Loop wrapped in play() + Run button
+# Physics thread + render loop wrapped in play() + Run button
 # =======================================================
-def play():
-    i = 0
+def physics():
+    start = time.perf_counter()
     while True:
         # Harmonic driving of the centre node (z-direction)
         middle.pos[2] = 0.1 * sin(2 * pi / DRIVE_PERIOD * sim.time)
+        sim.update()
 
-        # Throttle rendering to every second physics step
-        if i % 2 == 0:
-            visual_sim.update()
+        # Publish a snapshot; the render loop draws the latest one at FPS
+        visual_sim.post()
 
-        sim.update()
-        i += 1
+        # Keep to SPEED x real time
+        ahead = sim.time / SPEED - (time.perf_counter() - start)
+        if ahead > 0:
+            time.sleep(ahead)
+
+
+def play():
+    visual_sim.start(physics, fps=FPS)
 
 
 # VPython button to start the simulation
@@ -0,0 +1,75 @@
+import numpy as np
+from interactions import cell_list_pairs
+
+# Vectorized generators for large regular scenes. They return plain arrays
+# for Simulation.add_particles / add_springs:
+#   pos = grid((100, 100), spacing=0.01)
+#   sim.add_particles(1.0, pos, movable=~grid_border((100, 100)))
+#   sim.add_springs(*grid_edges((100, 100)), k=100.0)
+
+FCC_BASIS = ((0.0, 0.0, 0.0), (0.5, 0.5, 0.0), (0.5, 0.0, 0.5), (0.0, 0.5, 0.5))
+BCC_BASIS = ((0.0, 0.0, 0.0), (0.5, 0.5, 0.5))
+
+# Nodes of a 1D, 2D or 3D rectangular grid of `shape` nodes as an (N, 3)
+# array, starting at `origin` and spanning the x, y and z axes in that order
+# (z = 0 for 2D grids). Nodes are numbered row-major, so node (i, j) of a 2D
+# grid is ny * i + j. `spacing` is a scalar or one value per axis.
+def grid(shape, spacing=1.0, origin=(0.0, 0.0, 0.0)):
+    shape = tuple(np.atleast_1d(shape))
+    axes = [np.arange(n) * h for n, h in zip(shape, np.broadcast_to(spacing, len(shape)))]
+    pos = np.zeros((int(np.prod(shape)), 3))
+    pos[:, :len(shape)] = np.stack(np.meshgrid(*axes, indexing='ij'), -1).reshape(-1, len(shape))
+    return pos + origin
+
+# Index pairs (i, j) of the nearest neighbours along every axis of a grid
+def grid_edges(shape):
+    shape = tuple(np.atleast_1d(shape))
+    index = np.arange(int(np.prod(shape))).reshape(shape)
+    i, j = [], []
+    for axis in range(len(shape)):
+        lo = [slice(None)] * len(shape)
+        hi = [slice(None)] * len(shape)
+        lo[axis], hi[axis] = slice(None, -1), slice(1, None)
+        i.append(index[tuple(lo)].ravel())
+        j.append(index[tuple(hi)].ravel())
+    return np.concatenate(i), np.concatenate(j)
+
+# Boolean mask of the grid nodes on the boundary
+def grid_border(shape):
+    shape = tuple(np.atleast_1d(shape))
+    border = np.zeros(shape, bool)
+    for axis in range(len(shape)):
+        edge = [slice(None)] * len(shape)
+        for end in (0, -1):
+            edge[axis] = end
+            border[tuple(edge)] = True
+    return border.ravel()
+
+# Points of a lattice of `cells` unit cells (an int or one count per axis)
+# with lattice constant `a`; `basis` holds the positions inside the unit
+# cell in units of a. The points of one cell are consecutive.
+def lattice(cells, basis=((0.0, 0.0, 0.0),), a=1.0, origin=(0.0, 0.0, 0.0)):
+    corners = grid(np.broadcast_to(cells, 3), a)
+    return (corners[:, None, :] + a * np.asarray(basis, float)).reshape(-1, 3) + origin
+
+def cubic_lattice(cells, a=1.0, origin=(0.0, 0.0, 0.0)):
+    return lattice(cells, ((0.0, 0.0, 0.0),), a, origin)
+
+# Face-centred cubic: 4 points per cell, nearest neighbours a / sqrt(2) apart
+def fcc_lattice(cells, a=1.0, origin=(0.0, 0.0, 0.0)):
+    return lattice(cells, FCC_BASIS, a, origin)
+
+# Body-centred cubic: 2 points per cell, nearest neighbours a sqrt(3) / 2 apart
+def bcc_lattice(cells, a=1.0, origin=(0.0, 0.0, 0.0)):
+    return lattice(cells, BCC_BASIS, a, origin)
+
+# All pairs i < j at most `cutoff` apart, found by spatial hashing (see
+# interactions.cell_list_pairs) rather than by checking every pair. The
+# cutoff is widened by the relative `tol` so that lattice distances equal to
+# it are kept despite rounding. Pairs are sorted by i, then j.
+def spring_network(pos, cutoff, tol=1e-9):
+    pos = np.asarray(pos, float)
+    i, j = cell_list_pairs(pos, cutoff * (1 + tol))
+    i, j = np.minimum(i, j), np.maximum(i, j)
+    order = np.argsort(i * len(pos) + j)
+    return i[order], j[order]
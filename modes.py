@@ -0,0 +1,206 @@
+import hashlib
+import os
+import numpy as np
+
+try:
+    from scipy import sparse
+    from scipy.sparse.linalg import eigsh
+except ImportError:
+    sparse = None
+
+# Normal-mode analysis of the spring network, linearized about the current
+# configuration x_ref. With u = x - x_ref the linear equations of motion of
+# the movable particles are
+#   M u'' = f - K u
+# where K is the spring stiffness matrix, M the (diagonal) mass matrix and f
+# the net force at x_ref (springs and fields, held constant). Immovable
+# particles are fixed degrees of freedom and are left out. scipy is optional:
+# without it the matrices are dense and all modes come from numpy.
+
+CACHE_SIZE = 8  # decompositions kept in memory
+_cache = {}
+
+# Degrees of freedom of the movable particles: x, y, z of each in turn
+def free_dofs(sim):
+    free = np.flatnonzero(sim.state.movable)
+    return (3 * free[:, None] + np.arange(3)).ravel()
+
+# Stiffness matrix over the free degrees of freedom (3 per movable particle),
+# a scipy.sparse CSR matrix, or a dense array without scipy
+def stiffness_matrix(sim, pos=None):
+    state = sim.state
+    springs = sim.spring_state
+    pos = state.pos if pos is None else pos
+    dof = np.full(state.count, -1)
+    free = np.flatnonzero(state.movable)
+    dof[free] = np.arange(len(free))
+    size = 3 * len(free)
+    if not springs.count:
+        return sparse.csr_matrix((size, size)) if sparse is not None else np.zeros((size, size))
+    H, _ = springs.jacobian(pos, clamp=False)
+    i, j = springs.i, springs.j
+    p = np.concatenate((i, j, i, j))
+    q = np.concatenate((i, j, j, i))
+    blocks = np.concatenate((H, H, -H, -H))
+    keep = (dof[p] >= 0) & (dof[q] >= 0)
+    p, q, blocks = dof[p[keep]], dof[q[keep]], blocks[keep]
+    rows = np.broadcast_to((3 * p[:, None, None] + np.arange(3)[:, None]), blocks.shape).ravel()
+    cols = np.broadcast_to((3 * q[:, None, None] + np.arange(3)), blocks.shape).ravel()
+    if sparse is not None:
+        return sparse.csr_matrix((blocks.ravel(), (rows, cols)), shape=(size, size))
+    K = np.zeros((size, size))
+    np.add.at(K, (rows, cols), blocks.ravel())
+    return K
+
+# Diagonal mass matrix over the free degrees of freedom
+def mass_matrix(sim):
+    m = np.repeat(sim.state.mass[sim.state.movable], 3)
+    return sparse.diags(m, format='csr') if sparse is not None else np.diag(m)
+
+# Key of a linearization: everything the decomposition depends on
+def _key(sim, count):
+    state = sim.state
+    springs = sim.spring_state
+    h = hashlib.sha1(repr(count).encode())
+    for a in (state.pos, state.mass, state.movable, springs.i, springs.j, springs.k, springs.L0):
+        h.update(np.ascontiguousarray(a).data)
+    return h.hexdigest()
+
+# The `count` lowest eigenpairs of K phi = lambda M phi (all of them when
+# count is None), as eigenvalues (k,) and M-orthonormal modes (3F, k). Few
+# modes of a large network come from scipy's shift-invert Lanczos solver
+# (eigsh), shifted slightly below zero so that rigid and other zero-frequency
+# modes do not make the factorization singular.
+def eigenmodes(K, m, count=None):
+    size = len(m)
+    scale = 1 / np.sqrt(m)
+    if sparse is not None and sparse.issparse(K):
+        A = sparse.diags(scale) @ K @ sparse.diags(scale)
+        if count is not None and count < size - 1:
+            diagonal = abs(A.diagonal()).max() if size else 0.0
+            values, vectors = eigsh(A.tocsc(), count, sigma=-1e-6 * (diagonal or 1.0), which='LM')
+            order = np.argsort(values)
+            return values[order], scale[:, None] * vectors[:, order]
+        A = A.toarray()
+    else:
+        A = scale[:, None] * K * scale
+    values, vectors = np.linalg.eigh(A)
+    count = size if count is None else min(count, size)
+    return values[:count], scale[:, None] * vectors[:, :count]
+
+# Modal superposition of the spring network linearized about the current
+# state. The lowest `count` modes (all when None) are kept:
+#   modes = NormalModes(sim, count=50)
+#   modes.frequencies                 # angular frequencies, (count,)
+#   sim.state.pos[center, 2] += 0.01  # displace, then
+#   modes.project()                   # take the initial conditions from sim
+#   pos, vel = modes.at(t)            # state at any time, without stepping
+# Each mode evolves independently from its projected initial displacement and
+# velocity; unstable modes (negative eigenvalues, e.g. of compressed springs)
+# grow exponentially and zero-frequency ones drift. Motion outside the kept
+# modes is dropped. Decompositions are cached by the reference state in memory
+# and, when `cache` names a directory, on disk across runs.
+class NormalModes:
+    def __init__(self, sim, count=None, cache=None):
+        if sim.rod_state.count:
+            raise ValueError("normal modes do not support rods")
+        self.sim = sim
+        self.reference = sim.state.pos.copy()
+        self.dofs = free_dofs(sim)
+        self.mass = np.repeat(sim.state.mass, 3)[self.dofs]
+        key = _key(sim, count)
+        path = os.path.join(cache, f'modes-{key}.npz') if cache is not None else None
+        if key in _cache:
+            self.eigenvalues, self.vectors = _cache[key]
+        elif path is not None and os.path.exists(path):
+            with np.load(path) as data:
+                self.eigenvalues, self.vectors = data['eigenvalues'], data['vectors']
+        else:
+            self.eigenvalues, self.vectors = eigenmodes(stiffness_matrix(sim), self.mass, count)
+            if path is not None:
+                os.makedirs(cache, exist_ok=True)
+                with open(path + '.tmp', 'wb') as f:
+                    np.savez(f, eigenvalues=self.eigenvalues, vectors=self.vectors)
+                os.replace(path + '.tmp', path)
+        _cache.pop(key, None)
+        _cache[key] = (self.eigenvalues, self.vectors)
+        while len(_cache) > CACHE_SIZE:
+            del _cache[next(iter(_cache))]
+        # Eigenvalues this small next to the stiffest spring are zero modes
+        springs = sim.spring_state
+        stiffest = np.abs(springs.k).max() / self.mass.min() if springs.count and len(self.mass) else 0.0
+        self.tolerance = 1e-9 * stiffest
+        self.load = self.vectors.T @ self.forces()
+        self.project()
+
+    @property
+    def frequencies(self):
+        return np.sqrt(np.abs(self.eigenvalues))
+
+    # Mode shapes as (count, N, 3) displacements, zero at fixed particles
+    @property
+    def shapes(self):
+        out = np.zeros((len(self.eigenvalues), 3 * len(self.reference)))
+        out[:, self.dofs] = self.vectors.T
+        return out.reshape(len(self.eigenvalues), -1, 3)
+
+    # Net force on the free degrees of freedom at the reference state, with
+    # the velocities (and so damping and drag) set to zero
+    def forces(self):
+        state = self.sim.state
+        vel, acc = state.vel.copy(), state.acc.copy()
+        state.vel[:] = 0.0
+        try:
+            f = state.mass[:, None] * self.sim.compute_accelerations()
+        finally:
+            state.vel[:] = vel
+            state.acc[:] = acc
+        return f.ravel()[self.dofs]
+
+    # Modal coordinates of the given state (default: the simulation's) as the
+    # initial conditions at time t0 (default: sim.time)
+    def project(self, pos=None, vel=None, t0=None):
+        state = self.sim.state
+        pos = state.pos if pos is None else np.asarray(pos, float)
+        vel = state.vel if vel is None else np.asarray(vel, float)
+        self.t0 = self.sim.time if t0 is None else t0
+        self.q0 = self.vectors.T @ (self.mass * (pos - self.reference).ravel()[self.dofs])
+        self.qdot0 = self.vectors.T @ (self.mass * vel.ravel()[self.dofs])
+
+    # Modal coordinates and velocities at the times t, (T, count) each
+    def coordinates(self, t):
+        lam = self.eigenvalues
+        tol = self.tolerance
+        static = np.divide(self.load, lam, out=np.zeros_like(lam), where=np.abs(lam) > tol)
+        tau = np.reshape(t, (-1, 1)) - self.t0
+        w = np.sqrt(np.abs(lam))
+        with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+            wt = w * tau
+            C = np.where(lam > tol, np.cos(wt), np.where(lam < -tol, np.cosh(wt), 1.0))
+            S = np.where(lam > tol, np.sin(wt) / w, np.where(lam < -tol, np.sinh(wt) / w, tau))
+            dC = np.where(lam > tol, -w * np.sin(wt), np.where(lam < -tol, w * np.sinh(wt), 0.0))
+            dS = np.where(lam > tol, np.cos(wt), np.where(lam < -tol, np.cosh(wt), 1.0))
+        # Zero-frequency modes accelerate uniformly under their load
+        zero = np.abs(lam) <= tol
+        offset = self.q0 - static
+        q = static + offset * C + self.qdot0 * S + np.where(zero, 0.5 * self.load * tau**2, 0.0)
+        qdot = offset * dC + self.qdot0 * dS + np.where(zero, self.load * tau, 0.0)
+        return q, qdot
+
+    # Positions and velocities (N, 3) at time t, or (T, N, 3) for an array of times
+    def at(self, t):
+        q, qdot = self.coordinates(t)
+        shape = (len(q), len(self.reference), 3)
+        pos = np.broadcast_to(self.reference, shape).copy()
+        vel = np.zeros(shape)
+        pos.reshape(len(q), -1)[:, self.dofs] += q @ self.vectors.T
+        vel.reshape(len(q), -1)[:, self.dofs] = qdot @ self.vectors.T
+        if np.ndim(t) == 0:
+            return pos[0], vel[0]
+        return pos, vel
+
+    # Moves the simulation to time t
+    def apply(self, t):
+        state = self.sim.state
+        state.pos[:], state.vel[:] = self.at(t)
+        self.sim.time = t
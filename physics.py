@@ -1,3 +1,8 @@
+import json
+import os
+import threading
+from contextlib import contextmanager
+from time import perf_counter
 import numpy as np
 from math import sqrt
 
@@ -5,22 +10,236 @@ from math import sqrt
 vnorm = lambda x: sqrt(x.dot(x))
 vnorm2 = lambda x: x.dot(x)
 
+# Removes `rows` (sorted and unique) from the state arrays `names` by moving
+# the last surviving rows into the holes, so only O(len(rows)) data moves and
+# the arrays stay contiguous. Returns (holes, moved): row moved[k] is now
+# row holes[k].
+def _compact(state, names, rows):
+    n, m = state.count, len(rows)
+    holes = rows[rows < n - m]
+    tail = np.arange(n - m, n)
+    moved = tail[~np.isin(tail, rows)]
+    for name in names:
+        buffer = getattr(state, name)
+        buffer[holes] = buffer[moved]
+    state.count = n - m
+    state._views()
+    return holes, moved
+
+# Per-particle property columns of a ParticleState, {name: (N, ...) array}.
+# Assigning to a name copies into its column; assigning to a new name declares
+# a column with the dtype and trailing shape of the value.
+class Properties(dict):
+    def __init__(self, state):
+        super().__init__()
+        self._state = state
+
+    def __setitem__(self, name, value):
+        if name not in self:
+            value = np.asarray(value)
+            self._state.declare(name, value.dtype, shape=value.shape[1:])
+        self[name][...] = value
+
+    def __delitem__(self, name):
+        self._state.undeclare(name)
+
+    def update(self, *args, **kwargs):
+        for name, value in dict(*args, **kwargs).items():
+            self[name] = value
+
+    def clear(self):
+        for name in list(self):
+            del self[name]
+
+# Structure-of-arrays storage for particle data. Rows are particle indices;
+# the public attributes are views of the first `count` rows of over-allocated
+# buffers, so appending is amortized O(1). Declared property columns (charge,
+# radius, ...) are kept the same way and exposed in `properties`.
+class ParticleState:
+    def __init__(self, capacity=16):
+        self.count = 0
+        self._pos = np.zeros((capacity, 3))
+        self._vel = np.zeros((capacity, 3))
+        self._acc = np.zeros((capacity, 3))
+        self._mass = np.zeros(capacity)
+        self._movable = np.zeros(capacity, bool)
+        self._columns = {}
+        self.defaults = {}
+        self.properties = Properties(self)
+        self._views()
+
+    def __len__(self):
+        return self.count
+
+    def _views(self):
+        n = self.count
+        self.pos = self._pos[:n]
+        self.vel = self._vel[:n]
+        self.acc = self._acc[:n]
+        self.mass = self._mass[:n]
+        self.movable = self._movable[:n]
+        for name, column in self._columns.items():
+            dict.__setitem__(self.properties, name, column[:n])
+
+    # Adds a property column whose rows, present and future, start at `default`
+    def declare(self, name, dtype=float, default=0, shape=()):
+        if name in self._columns:
+            raise ValueError(f"property {name!r} already exists")
+        if name == 'index' or name.startswith('_') or hasattr(Particle, name):
+            raise ValueError(f"property name {name!r} is reserved")
+        self._columns[name] = np.full((len(self._mass),) + tuple(shape), default, dtype)
+        self.defaults[name] = default
+        self._views()
+        return self.properties[name]
+
+    def undeclare(self, name):
+        del self._columns[name]
+        del self.defaults[name]
+        dict.__delitem__(self.properties, name)
+
+    def reserve(self, capacity):
+        if capacity <= len(self._mass):
+            return
+        capacity = max(capacity, 2 * len(self._mass))
+        for name in ('_pos', '_vel', '_acc', '_mass', '_movable'):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+        for name, old in self._columns.items():
+            new = np.full((capacity,) + old.shape[1:], self.defaults[name], old.dtype)
+            new[:self.count] = old[:self.count]
+            self._columns[name] = new
+        self._views()
+
+    def append(self, mass, position, velocity=None, movable=True):
+        i = self.count
+        self.reserve(i + 1)
+        self._pos[i] = position
+        self._vel[i] = 0.0 if velocity is None else velocity
+        self._acc[i] = 0.0
+        self._mass[i] = mass
+        self._movable[i] = movable
+        for name, column in self._columns.items():
+            column[i] = self.defaults[name]
+        self.count = i + 1
+        self._views()
+        return i
+
+    # Appends len(position) rows at once; returns the index of the first.
+    # `properties` gives values for some of the columns.
+    def extend(self, mass, position, velocity=None, movable=True, properties=None):
+        start, n = self.count, len(position)
+        self.reserve(start + n)
+        rows = slice(start, start + n)
+        self._pos[rows] = position
+        self._vel[rows] = 0.0 if velocity is None else velocity
+        self._acc[rows] = 0.0
+        self._mass[rows] = mass
+        self._movable[rows] = movable
+        properties = properties or {}
+        for name in properties:
+            if name not in self._columns:
+                raise KeyError(f"unknown property {name!r}")
+        for name, column in self._columns.items():
+            column[rows] = properties.get(name, self.defaults[name])
+        self.count = start + n
+        self._views()
+        return start
+
+    def remove(self, rows):
+        holes, moved = _compact(self, ('_pos', '_vel', '_acc', '_mass', '_movable'), rows)
+        for column in self._columns.values():
+            column[holes] = column[moved]
+        return holes, moved
+
+    # Velocity and position updates, applied to the movable rows only
+    def kick(self, dt):
+        if self.movable.all():
+            self.vel += self.acc * dt
+        else:
+            idx = np.flatnonzero(self.movable)
+            self.vel[idx] += self.acc[idx] * dt
+
+    def drift(self, dt):
+        if self.movable.all():
+            self.pos += self.vel * dt
+        else:
+            idx = np.flatnonzero(self.movable)
+            self.pos[idx] += self.vel[idx] * dt
+
+# Lightweight handle to one row of a ParticleState. A standalone Particle owns a
+# one-row state; particles created by a Simulation share the simulation's state.
+# Attributes named after a declared property column read and write that column
+# (particle.charge is sim.properties['charge'][particle.index]); any other
+# attribute is stored on the handle.
 class Particle:
-    def __init__(self, mass, position, velocity=None, movable=True, properties=None):
-        self.mass = mass
-        self.pos = np.asarray(position, float)
-        self.vel = (np.zeros(3) if velocity is None else np.asarray(velocity, float))
-        self.acc = np.zeros(3)
-        self.movable = movable
+    def __init__(self, mass, position, velocity=None, movable=True, properties=None, state=None):
+        self._state = ParticleState(1) if state is None else state
+        self.index = self._state.append(mass, position, velocity, movable)
 
         if callable(properties):  # factory style
             properties(self)
         elif properties is not None:  # dict style
             for k, v in properties.items():
                 setattr(self, k, v)
-        else:  # default
+        elif 'type' not in self._state._columns:  # default
             self.type = None
 
+    def __getattr__(self, name):
+        state = self.__dict__.get('_state')
+        if state is not None and name in state._columns:
+            value = state.properties[name][self.index]
+            return value.item() if value.ndim == 0 else value
+        raise AttributeError(f"'Particle' object has no attribute {name!r}")
+
+    def __setattr__(self, name, value):
+        state = self.__dict__.get('_state')
+        if state is not None and name in state._columns:
+            state.properties[name][self.index] = value
+        else:
+            object.__setattr__(self, name, value)
+
+    @property
+    def pos(self):
+        return self._state.pos[self.index]
+
+    @pos.setter
+    def pos(self, value):
+        self._state.pos[self.index] = value
+
+    @property
+    def vel(self):
+        return self._state.vel[self.index]
+
+    @vel.setter
+    def vel(self, value):
+        self._state.vel[self.index] = value
+
+    @property
+    def acc(self):
+        return self._state.acc[self.index]
+
+    @acc.setter
+    def acc(self, value):
+        self._state.acc[self.index] = value
+
+    @property
+    def mass(self):
+        return float(self._state.mass[self.index])
+
+    @mass.setter
+    def mass(self, value):
+        self._state.mass[self.index] = value
+
+    @property
+    def movable(self):
+        return bool(self._state.movable[self.index])
+
+    @movable.setter
+    def movable(self, value):
+        self._state.movable[self.index] = value
+
     def update(self, dt):
         # Semi-implicit Euler method
         self.vel = self.vel + self.acc * dt
@@ -29,16 +248,167 @@ class Particle:
     def energy(self):
         return 0.5 * self.mass * vnorm2(self.vel)
 
-# Defines a Hooke's law force between two particles
+# Adds each row of `values` into `out` at the matching row of `index`, summing
+# repeated indices (a vectorized scatter-add)
+def scatter_add(out, index, values):
+    if out.ndim == 3:
+        # (M, N, 3) ensemble arrays with (M, len(index), 3) values: scatter every
+        # member into its own rows
+        m, n = out.shape[:2]
+        flat = out.reshape(-1, 3)
+        scatter_add(flat, (np.arange(m)[:, None] * n + index).ravel(), values.reshape(-1, 3))
+        out[:] = flat.reshape(out.shape)
+        return
+    n = len(out)
+    for d in range(out.shape[1]):
+        out[:, d] += np.bincount(index, values[:, d], minlength=n)
+
+# Structure-of-arrays storage for springs: endpoint indices into a
+# ParticleState together with stiffness, rest length and the tensile strain
+# (L - L0) / L0 past which the spring breaks (inf: never). `breakable` is set
+# once any spring has a finite limit; `broken` counts the springs broken so far.
+class SpringState:
+    def __init__(self, capacity=16):
+        self.count = 0
+        self.breakable = False
+        self.broken = 0
+        self._i = np.zeros(capacity, np.intp)
+        self._j = np.zeros(capacity, np.intp)
+        self._k = np.zeros(capacity)
+        self._L0 = np.zeros(capacity)
+        self._limit = np.full(capacity, np.inf)
+        self._views()
+
+    def __len__(self):
+        return self.count
+
+    def _views(self):
+        n = self.count
+        self.i = self._i[:n]
+        self.j = self._j[:n]
+        self.k = self._k[:n]
+        self.L0 = self._L0[:n]
+        self.limit = self._limit[:n]
+
+    def reserve(self, capacity):
+        if capacity <= len(self._k):
+            return
+        capacity = max(capacity, 2 * len(self._k))
+        for name in ('_i', '_j', '_k', '_L0', '_limit'):
+            old = getattr(self, name)
+            new = np.full(capacity, np.inf) if name == '_limit' else np.zeros(capacity, old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+        self._views()
+
+    def append(self, i, j, k, L0, limit=np.inf):
+        n = self.count
+        self.reserve(n + 1)
+        self._i[n] = i
+        self._j[n] = j
+        self._k[n] = k
+        self._L0[n] = L0
+        self._limit[n] = limit
+        self.breakable |= bool(np.isfinite(limit))
+        self.count = n + 1
+        self._views()
+        return n
+
+    def extend(self, i, j, k, L0, limit=np.inf):
+        start, n = self.count, len(i)
+        self.reserve(start + n)
+        rows = slice(start, start + n)
+        self._i[rows] = i
+        self._j[rows] = j
+        self._k[rows] = k
+        self._L0[rows] = L0
+        self._limit[rows] = limit
+        self.breakable |= bool(np.isfinite(limit).any())
+        self.count = start + n
+        self._views()
+        return start
+
+    def remove(self, rows):
+        return _compact(self, ('_i', '_j', '_k', '_L0', '_limit'), rows)
+
+    # Rows of the springs stretched past their strain limit at `pos`
+    def strained(self, pos):
+        axis = self.differences(pos)
+        length = np.sqrt(np.einsum('ij,ij->i', axis, axis))
+        return np.flatnonzero(length > self.L0 * (1 + self.limit))
+
+    # x[j] - x[i] for every spring
+    def differences(self, x):
+        return x[..., self.j, :] - x[..., self.i, :]
+
+    # Force on the first endpoint of every spring (the second gets the opposite),
+    # including the dashpot term along the spring when `b` is given
+    def forces(self, pos, vel, b=None):
+        axis = self.differences(pos)
+        length = np.sqrt(np.einsum('...i,...i->...', axis, axis))
+        F = (self.k * (1 - self.L0 / length))[..., None] * axis
+        if b is not None:
+            n = axis / length[..., None]
+            v_rel = self.differences(vel)
+            Ldot = np.einsum('...i,...i->...', v_rel, n)
+            F += (b * Ldot)[..., None] * n
+        return F
+
+    # Jacobian blocks dF/d(axis) = k [(1 - L0/L)(I - n n^T) + n n^T] of the spring
+    # forces and the unit axes n. The tension term is clamped at zero so the
+    # blocks stay positive semi-definite for compressed springs; clamp=False
+    # gives the exact second derivatives of the spring energy.
+    def jacobian(self, pos, clamp=True):
+        axis = pos[self.j] - pos[self.i]
+        length = np.sqrt(np.einsum('ij,ij->i', axis, axis))
+        n = axis / length[:, None]
+        nn = n[:, :, None] * n[:, None, :]
+        tension = 1 - self.L0 / length
+        if clamp:
+            tension = np.maximum(tension, 0.0)
+        J = (self.k * tension)[:, None, None] * np.eye(3) + (self.k * (1 - tension))[:, None, None] * nn
+        return J, n
+
+    def energy(self, pos):
+        axis = self.differences(pos)
+        length = np.sqrt(np.einsum('...i,...i->...', axis, axis))
+        return 0.5 * (self.k * (length - self.L0)**2).sum(-1)
+
+# Defines a Hooke's law force between two particles. Like Particle, a Spring is a
+# handle to one row of a SpringState.
 class Spring:
-    def __init__(self, p1, p2, k, L0=None):
+    def __init__(self, p1, p2, k, L0=None, state=None):
         self.p1 = p1
         self.p2 = p2
-        self.k = k
+        self._state = SpringState(1) if state is None else state
         if L0 is None:
-            self.L0 = self.length()
-        else:
-            self.L0 = L0
+            L0 = vnorm(p2.pos - p1.pos)
+        self.index = self._state.append(p1.index, p2.index, k, L0)
+
+    @property
+    def k(self):
+        return float(self._state.k[self.index])
+
+    @k.setter
+    def k(self, value):
+        self._state.k[self.index] = value
+
+    @property
+    def L0(self):
+        return float(self._state.L0[self.index])
+
+    @L0.setter
+    def L0(self, value):
+        self._state.L0[self.index] = value
+
+    @property
+    def max_strain(self):
+        return float(self._state.limit[self.index])
+
+    @max_strain.setter
+    def max_strain(self, value):
+        self._state.limit[self.index] = value
+        self._state.breakable |= bool(np.isfinite(value))
 
     def length(self):
         return vnorm(self.p2.pos - self.p1.pos)
@@ -59,41 +429,873 @@ class Spring:
     def energy(self):
         return 0.5 * self.k * abs(vnorm(self.p2.pos - self.p1.pos)-self.L0)**2
 
+# Rigid distance constraints |x_j - x_i| = L, stored like springs. After an
+# unconstrained step the positions are projected back onto the constraints by
+# SHAKE: corrections along the rod vectors r0 of the configuration before the
+# step, with all rod multipliers solved for at once in every Newton iteration
+# from (C M^-1 C0^T) lambda = g / 2 (the rows of C and C0 hold the current and
+# the initial rod vectors on both ends). The velocities are then made tangent
+# to the constraints (RATTLE). Small systems are solved densely (least squares,
+# so redundant rods are fine), larger ones matrix-free with conjugate gradients.
+class RodState:
+    def __init__(self, capacity=16, tol=1e-9, max_iter=50, dense_limit=2**20):
+        self.count = 0
+        self.tol = tol
+        self.max_iter = max_iter
+        self.dense_limit = dense_limit
+        self.iterations = 0
+        self._i = np.zeros(capacity, np.intp)
+        self._j = np.zeros(capacity, np.intp)
+        self._length = np.zeros(capacity)
+        self._views()
+
+    def __len__(self):
+        return self.count
+
+    def _views(self):
+        n = self.count
+        self.i = self._i[:n]
+        self.j = self._j[:n]
+        self.length = self._length[:n]
+
+    def reserve(self, capacity):
+        if capacity <= len(self._length):
+            return
+        capacity = max(capacity, 2 * len(self._length))
+        for name in ('_i', '_j', '_length'):
+            old = getattr(self, name)
+            new = np.zeros(capacity, old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+        self._views()
+
+    def append(self, i, j, length):
+        n = self.count
+        self.reserve(n + 1)
+        self._i[n] = i
+        self._j[n] = j
+        self._length[n] = length
+        self.count = n + 1
+        self._views()
+        return n
+
+    def remove(self, rows):
+        return _compact(self, ('_i', '_j', '_length'), rows)
+
+    # Solves (C M^-1 C0^T) x = rhs, where the rows of C and C0 are built from
+    # the rod vectors r and r0. The iterative path uses the symmetric C0 M^-1 C0^T
+    # instead, which is close for small steps.
+    def solve(self, r, r0, inv_mass, rhs):
+        i, j = self.i, self.j
+        m, n = len(r), len(inv_mass)
+        if m * m * n <= self.dense_limit:
+            rows = np.arange(m)
+            C = np.zeros((m, n, 3))
+            C[rows, j] = r
+            C[rows, i] -= r
+            C0 = np.zeros((m, n, 3))
+            C0[rows, j] = r0
+            C0[rows, i] -= r0
+            A = np.einsum('cpk,p,dpk->cd', C, inv_mass, C0)
+            return np.linalg.lstsq(A, rhs, rcond=1e-10)[0]
+        ends = np.concatenate((i, j))
+
+        def apply(p):
+            u = np.zeros((n, 3))
+            scatter_add(u, ends, np.concatenate((-p[:, None] * r0, p[:, None] * r0)))
+            u *= inv_mass[:, None]
+            return np.einsum('ij,ij->i', u[j] - u[i], r0)
+
+        diagonal = (inv_mass[i] + inv_mass[j]) * np.einsum('ij,ij->i', r0, r0)
+        active = diagonal > 0
+        diagonal[~active] = 1.0
+        x, _ = conjugate_gradient(apply, rhs * active, np.zeros(m), diagonal, self.tol, 10 * m)
+        return x
+
+    # Applies x -= M^-1 C^T lam (and the same for velocities)
+    def _correct(self, x, r, lam, inv_mass):
+        i, j = self.i, self.j
+        step = lam[:, None] * r
+        scatter_add(x, np.concatenate((i, j)),
+                    np.concatenate((inv_mass[i, None] * step, -inv_mass[j, None] * step)))
+
+    # SHAKE: iterations on |r|^2 - L^2 = 0 with corrections along r0 = ref[j] - ref[i]
+    def shake(self, pos, ref, inv_mass):
+        i, j = self.i, self.j
+        L2 = self.length**2
+        r0 = ref[j] - ref[i]
+        active = (inv_mass[i] + inv_mass[j]) > 0
+        for iteration in range(self.max_iter):
+            r = pos[j] - pos[i]
+            g = np.einsum('ij,ij->i', r, r) - L2
+            if np.abs(g[active] / L2[active]).max(initial=0.0) <= 2 * self.tol:
+                return iteration
+            self._correct(pos, r0, self.solve(r, r0, inv_mass, 0.5 * g), inv_mass)
+        return self.max_iter
+
+    # RATTLE: removes the relative velocity along every rod
+    def rattle(self, pos, vel, inv_mass):
+        i, j = self.i, self.j
+        r = pos[j] - pos[i]
+        rv = np.einsum('ij,ij->i', r, vel[j] - vel[i])
+        self._correct(vel, r, self.solve(r, r, inv_mass, rv), inv_mass)
+
+    # Projects the state reached by an unconstrained step from positions `ref`
+    # back onto the constraints. The position correction is also applied to the
+    # velocities as an impulse, followed by the RATTLE velocity projection.
+    def constrain(self, state, ref, dt):
+        inv_mass = np.where(state.movable, 1 / state.mass, 0.0)
+        before = state.pos.copy()
+        self.iterations = self.shake(state.pos, ref, inv_mass)
+        state.vel += (state.pos - before) / dt
+        self.rattle(state.pos, state.vel, inv_mass)
+
+class Rod:
+    def __init__(self, p1, p2, length, state):
+        self.p1 = p1
+        self.p2 = p2
+        self._state = state
+        self.index = state.append(p1.index, p2.index, length)
+
+    @property
+    def length(self):
+        return float(self._state.length[self.index])
+
+# Built-in batched fields. A batched field is called as
+# field(pos, vel, mass, properties, time) with the whole state arrays and returns
+# accelerations broadcastable to (N, 3) (or to (M, N, 3) in an Ensemble).
+# Conservative fields may also provide energy(pos, mass, properties).
+def uniform_field(acceleration):
+    acceleration = np.asarray(acceleration, float)
+    def field(pos, vel, mass, properties, time):
+        return acceleration
+    field.energy = lambda pos, mass, properties: -np.dot(mass, pos @ acceleration)
+    return field
+
+# Drag force -gamma * v
+def linear_drag(gamma):
+    def field(pos, vel, mass, properties, time):
+        return vel * (-gamma / mass)[..., None]
+    return field
+
+# Restoring force -k * (x - center)
+def harmonic_trap(k, center=(0.0, 0.0, 0.0)):
+    center = np.asarray(center, float)
+    def field(pos, vel, mass, properties, time):
+        return (pos - center) * (-k / mass)[..., None]
+    field.energy = lambda pos, mass, properties: 0.5 * k * ((pos - center)**2).sum()
+    return field
+
+# Integrators advance a whole Simulation by one step with step(sim, dt). They
+# only need sim.compute_accelerations(), which fills sim.state.acc from the
+# current positions, velocities and sim.time.
+
+# Semi-implicit (symplectic) Euler, first order. Forces are evaluated at the
+# end-of-step time, as the engine always has.
+class SemiImplicitEuler:
+    evaluations = 1
+    order = 1
+
+    def step(self, sim, dt):
+        sim.time += dt
+        sim.compute_accelerations()
+        sim.state.kick(dt)
+        sim.state.drift(dt)
+
+# Symplectic splitting drift(c[0] dt) kick(d[0] dt) drift(c[1] dt) ... drift(c[-1] dt)
+class SymplecticComposition:
+    def __init__(self, c, d, order):
+        self.c = c
+        self.d = d
+        self.order = order
+        self.evaluations = len(d)
+
+    def step(self, sim, dt):
+        state = sim.state
+        t0 = sim.time
+        elapsed = 0.0
+        for c, d in zip(self.c, self.d):
+            if c:
+                state.drift(c * dt)
+                elapsed += c
+            sim.time = t0 + elapsed * dt
+            sim.compute_accelerations()
+            state.kick(d * dt)
+        state.drift(self.c[-1] * dt)
+        sim.time = t0 + dt
+
+# Leapfrog / velocity Verlet in drift-kick-drift form: second order, one force
+# evaluation per step
+class Leapfrog(SymplecticComposition):
+    def __init__(self):
+        super().__init__((0.5, 0.5), (1.0,), 2)
+
+# Fourth-order Yoshida (Forest-Ruth) composition of three leapfrog steps
+class Yoshida4(SymplecticComposition):
+    def __init__(self):
+        w1 = 1 / (2 - 2**(1/3))
+        w0 = 1 - 2 * w1
+        super().__init__((w1 / 2, (w0 + w1) / 2, (w0 + w1) / 2, w1 / 2), (w1, w0, w1), 4)
+
+# Classical fourth-order Runge-Kutta; not symplectic, but accurate for
+# dissipative (damped, drag) systems
+class RK4:
+    evaluations = 4
+    order = 4
+
+    def step(self, sim, dt):
+        state = sim.state
+        t0 = sim.time
+        x0 = state.pos.copy()
+        v0 = state.vel.copy()
+        fixed = ~state.movable
+
+        def derivatives():
+            kx = state.vel.copy()
+            kv = sim.compute_accelerations().copy()
+            kx[..., fixed, :] = 0.0
+            kv[..., fixed, :] = 0.0
+            return kx, kv
+
+        kx, kv = derivatives()
+        dx, dv = kx.copy(), kv.copy()
+        for c, w in ((0.5, 2.0), (0.5, 2.0), (1.0, 1.0)):
+            state.pos[:] = x0 + c * dt * kx
+            state.vel[:] = v0 + c * dt * kv
+            sim.time = t0 + c * dt
+            kx, kv = derivatives()
+            dx += w * kx
+            dv += w * kv
+        state.pos[:] = x0 + dt / 6 * dx
+        state.vel[:] = v0 + dt / 6 * dv
+        sim.time = t0 + dt
+
+# Jacobi-preconditioned conjugate gradient for A x = b with A symmetric
+# positive definite, given only as the product apply(x). Starts from x and
+# stops once |r| <= tol |b|; returns the solution and the iteration count.
+def conjugate_gradient(apply, b, x, diagonal, tol=1e-8, max_iter=100):
+    b_norm = np.sqrt(np.vdot(b, b))
+    if b_norm == 0.0:
+        return np.zeros_like(b), 0
+    r = b - apply(x)
+    z = r / diagonal
+    p = z.copy()
+    rz = np.vdot(r, z)
+    for iteration in range(max_iter):
+        if np.sqrt(np.vdot(r, r)) <= tol * b_norm:
+            return x, iteration
+        Ap = apply(p)
+        alpha = rz / np.vdot(p, Ap)
+        x = x + alpha * p
+        r = r - alpha * Ap
+        z = r / diagonal
+        rz, rz_old = np.vdot(r, z), rz
+        p = z + (rz / rz_old) * p
+    return x, max_iter
+
+# Implicit integration of the spring network, in the style of Baraff & Witkin.
+# With v_a = (1 - a) v0 + a v1 and x_a = x0 + a dt v_a the step solves
+#   M (v1 - v0) = dt f(x_a, v_a),    x1 = x0 + dt v_a
+# by Newton iterations on v1 (one iteration is the classic linearly implicit
+# step). Each iteration solves
+#   (M - a dt D - a^2 dt^2 K) dv = dt f(x_a, v_a) - M (v1 - v0)
+# where K and D are the spring Jacobians w.r.t. positions and velocities
+# (fields are not differentiated). K and D are built blockwise from the spring
+# index arrays and applied matrix-free inside a conjugate gradient solve
+# warm-started with the previous step's velocity change.
+# a = 1 is backward Euler, a = 1/2 the implicit midpoint rule.
+class Implicit:
+    def __init__(self, alpha, newton=1, tol=1e-8, max_iter=100):
+        self.alpha = alpha
+        self.newton = newton
+        self.tol = tol
+        self.max_iter = max_iter
+        self.evaluations = newton
+        self.order = 2 if alpha == 0.5 else 1
+        self.guess = None
+        self.iterations = 0
+
+    def step(self, sim, dt):
+        state = sim.state
+        springs = sim.spring_state
+        a = self.alpha
+        t0 = sim.time
+        sim.time = t0 + a * dt
+        movable = state.movable[:, None]
+        m = state.mass[:, None]
+        x0 = state.pos.copy()
+        v0 = state.vel.copy()
+        v1 = v0.copy()
+        i, j = springs.i, springs.j
+        ends = np.concatenate((i, j))
+        guess = self.guess if self.guess is not None and self.guess.shape == v0.shape else np.zeros_like(v0)
+        self.iterations = 0
+        for _ in range(self.newton):
+            va = (1 - a) * v0 + a * v1
+            state.pos[:] = np.where(movable, x0 + (a * dt) * va, x0)
+            state.vel[:] = np.where(movable, va, v0)
+            acc = sim.compute_accelerations()
+            rhs = (dt * m * acc - m * (v1 - v0)) * movable
+            diagonal = m * np.ones(3)
+            G = np.zeros((0, 3, 3))
+            if springs.count:
+                J, n = springs.jacobian(state.pos)
+                G = (a * dt)**2 * J
+                if sim.damping:
+                    G += (a * dt * sim.dissipation_coefficient) * (n[:, :, None] * n[:, None, :])
+                g = np.einsum('saa->sa', G)
+                scatter_add(diagonal, ends, np.concatenate((g, g)))
+
+            def apply(p):
+                q = np.einsum('sab,sb->sa', G, p[j] - p[i])
+                out = m * p
+                scatter_add(out, ends, np.concatenate((-q, q)))
+                return out * movable
+
+            dv, iterations = conjugate_gradient(apply, rhs, guess * movable, diagonal, self.tol, self.max_iter)
+            self.iterations += iterations
+            v1 += dv
+            guess = np.zeros_like(v0)
+        self.guess = v1 - v0
+        state.pos[:] = np.where(movable, x0 + dt * ((1 - a) * v0 + a * v1), x0)
+        state.vel[:] = np.where(movable, v1, v0)
+        sim.time = t0 + dt
+
+class ImplicitEuler(Implicit):
+    def __init__(self, newton=1, tol=1e-8, max_iter=100):
+        super().__init__(1.0, newton, tol, max_iter)
+
+class ImplicitMidpoint(Implicit):
+    def __init__(self, newton=2, tol=1e-8, max_iter=100):
+        super().__init__(0.5, newton, tol, max_iter)
+
+# Multiple time stepping (r-RESPA, Tuckerman et al.): each force group is
+# evaluated `substeps[group]` times per step (`default` for groups not listed),
+# with the groups sharing a rate forming one level of nested leapfrog steps
+#   kick(slow, dt/2) [n x inner level with dt/n] kick(slow, dt/2)
+# down to a drift at the fastest level. Groups are 'springs', 'fields' (the
+# per-particle fields) and the batched field objects, e.g.
+#   MultiRate({'springs': 20, coulomb: 1})
+# Every rate has to divide the next faster one. Accelerations are reused when
+# a level kicks again at an unchanged position and time, so a group costs
+# `substeps` evaluations per step; call reset() after changing the forces
+# between steps. Second order; velocity-dependent forces are evaluated at the
+# velocity of the first of the two kicks.
+class MultiRate:
+    order = 2
+
+    def __init__(self, substeps=None, default=1):
+        self.substeps = {'springs': 10} if substeps is None else dict(substeps)
+        self.default = default
+        self.evaluations = min(list(self.substeps.values()) + [default])
+        self.reset()
+
+    def reset(self):
+        self._cache = {}
+
+    def levels(self, sim):
+        levels = {}
+        for group in sim.force_groups():
+            levels.setdefault(self.substeps.get(group, self.default), []).append(group)
+        rates = sorted(levels)
+        for slow, fast in zip(rates, rates[1:]):
+            if fast % slow:
+                raise ValueError(f"substep ratios must divide each other, got {slow} and {fast}")
+        return [(n, levels[n]) for n in rates]
+
+    def kick(self, sim, groups, h):
+        state = sim.state
+        key = tuple(map(id, groups))
+        cached = self._cache.get(key)
+        if cached is None or not np.array_equal(cached[0], sim.time) or not np.array_equal(cached[1], state.pos):
+            cached = (sim.time, state.pos.copy(), sim.compute_accelerations(groups).copy())
+            self._cache[key] = cached
+        state.acc[:] = cached[2]
+        state.kick(h)
+
+    def advance(self, sim, levels, level, t, h):
+        sim.time = t
+        groups = levels[level][1]
+        self.kick(sim, groups, 0.5 * h)
+        if level + 1 == len(levels):
+            sim.state.drift(h)
+        else:
+            n = levels[level + 1][0] // levels[level][0]
+            for k in range(n):
+                self.advance(sim, levels, level + 1, t + k * h / n, h / n)
+        sim.time = t + h
+        self.kick(sim, groups, 0.5 * h)
+
+    def step(self, sim, dt):
+        levels = self.levels(sim)
+        t0 = sim.time
+        if not levels:
+            sim.state.drift(dt)
+        else:
+            n = levels[0][0]
+            for k in range(n):
+                self.advance(sim, levels, 0, t0 + k * dt / n, dt / n)
+        sim.time = t0 + dt
+
+INTEGRATORS = {
+    'euler': SemiImplicitEuler,
+    'leapfrog': Leapfrog,
+    'verlet': Leapfrog,
+    'yoshida4': Yoshida4,
+    'forest-ruth': Yoshida4,
+    'rk4': RK4,
+    'implicit-euler': ImplicitEuler,
+    'implicit-midpoint': ImplicitMidpoint,
+    'respa': MultiRate,
+}
+
+# Adaptive step size control by step doubling, for any integrator: every step
+# is taken once with dt and once as two steps of dt/2, and the difference
+# estimates the local error. The step is accepted when
+#   max |difference| / (atol + rtol |y|) <= 1
+# over the positions and velocities of the movable particles (keeping the more
+# accurate two-half-step result), otherwise it is retried with a smaller dt.
+# The next dt follows the usual safety * err^(-1/(order+1)) rule, clamped to
+# [dt_min, dt_max]; at dt_min steps are accepted regardless (counted in
+# `forced`).
+class AdaptiveStepper:
+    def __init__(self, atol=1e-6, rtol=1e-6, dt_min=0.0, dt_max=np.inf, safety=0.9,
+                 max_growth=5.0, min_shrink=0.2):
+        self.atol = atol
+        self.rtol = rtol
+        self.dt_min = dt_min
+        self.dt_max = dt_max
+        self.safety = safety
+        self.max_growth = max_growth
+        self.min_shrink = min_shrink
+        self.accepted = 0
+        self.rejected = 0
+        self.forced = 0
+
+    def error(self, a, b):
+        scale = self.atol + self.rtol * np.maximum(np.abs(a), np.abs(b))
+        return (np.abs(a - b) / scale).max(initial=0.0)
+
+    # Takes one accepted step of at most dt; returns (dt taken, proposed next dt)
+    def step(self, sim, dt):
+        state = sim.state
+        order = getattr(sim.integrator, 'order', 1)
+        movable = state.movable
+        t0 = sim.time
+        x0 = state.pos.copy()
+        v0 = state.vel.copy()
+        while True:
+            sim.step(dt)
+            x1 = state.pos[movable]
+            v1 = state.vel[movable]
+            state.pos[:] = x0
+            state.vel[:] = v0
+            sim.time = t0
+            sim.step(0.5 * dt)
+            sim.step(0.5 * dt)
+            with np.errstate(invalid='ignore', over='ignore'):
+                err = max(self.error(x1, state.pos[movable]), self.error(v1, state.vel[movable]))
+            if not np.isfinite(err):
+                err = np.inf
+            with np.errstate(divide='ignore'):
+                factor = self.safety * err**(-1 / (order + 1)) if err > 0 else self.max_growth
+            factor = min(self.max_growth, max(self.min_shrink, factor))
+            if err <= 1 or dt <= self.dt_min:
+                self.accepted += 1
+                self.forced += int(err > 1)
+                sim.time = t0 + dt
+                return dt, min(self.dt_max, max(self.dt_min, dt * factor))
+            self.rejected += 1
+            state.pos[:] = x0
+            state.vel[:] = v0
+            sim.time = t0
+            dt = max(self.dt_min, dt * factor)
+
+# Checkpoint files: an 8-byte magic, the length of a JSON header, the header
+# ({'meta': ..., 'arrays': {name: [dtype, shape, offset]}}) and the raw arrays,
+# each starting at a 64-byte aligned offset so they can be memory-mapped.
+# Files are written next to `path` and moved into place when complete.
+CHECKPOINT_MAGIC = b'PHYSCHK1'
+
+def write_checkpoint(path, meta, arrays):
+    arrays = {name: np.ascontiguousarray(a) for name, a in arrays.items()}
+    layout = {}
+    offset = 0
+    for name, a in arrays.items():
+        layout[name] = [a.dtype.str, list(a.shape), offset]
+        offset += -(-a.nbytes // 64) * 64
+    header = json.dumps({'meta': meta, 'arrays': layout},
+                        default=lambda o: o.tolist() if hasattr(o, 'tolist') else repr(o)).encode()
+    start = -(-(16 + len(header)) // 64) * 64
+    with open(path + '.tmp', 'wb') as f:
+        f.write(CHECKPOINT_MAGIC + len(header).to_bytes(8, 'little') + header)
+        for name, a in arrays.items():
+            f.seek(start + layout[name][2])
+            f.write(a.data)
+        f.truncate(start + offset)
+    os.replace(path + '.tmp', path)
+
+# Returns (meta, arrays); with mmap=True the arrays are read-only memory maps
+def read_checkpoint(path, mmap=False):
+    with open(path, 'rb') as f:
+        if f.read(8) != CHECKPOINT_MAGIC:
+            raise ValueError(f"{path!r} is not a checkpoint file")
+        size = int.from_bytes(f.read(8), 'little')
+        header = json.loads(f.read(size))
+        start = -(-(16 + size) // 64) * 64
+        arrays = {}
+        for name, (dtype, shape, offset) in header['arrays'].items():
+            count = int(np.prod(shape))
+            if mmap:
+                arrays[name] = np.memmap(path, dtype, 'r', start + offset, tuple(shape))
+            else:
+                f.seek(start + offset)
+                arrays[name] = np.fromfile(f, dtype, count).reshape(shape)
+    return header['meta'], arrays
+
+# Opt-in timing of the simulation hot path. Assign sim.stats = SimulationStats()
+# (or use `with sim.profile() as stats:`) to accumulate, per phase, the number
+# of calls and the seconds spent:
+#   'step'        whole steps (update() / adaptive steps)
+#   'springs'     the batched spring pass
+#   <field name>  every batched and per-particle field, by function or class name
+#   'rods'        rod constraints
+#   'recorders'   attached recorders
+#   'callbacks'   run() / run_until() callbacks (outside 'step')
+# The integrator's own work is what remains of 'step'. With sim.stats = None
+# (the default) the hot path only pays for a few `is None` checks.
+class SimulationStats:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.steps = 0
+        self.evaluations = 0
+        self.phases = {}
+        self.labels = {}
+
+    def add(self, phase, seconds):
+        entry = self.phases.get(phase)
+        if entry is None:
+            entry = self.phases[phase] = [0, 0.0]
+        entry[0] += 1
+        entry[1] += seconds
+
+    # Phase name of a field: its function or class name, numbered if several
+    # fields share it
+    def label(self, field):
+        label = self.labels.get(id(field))
+        if label is None:
+            name = getattr(field, '__qualname__', type(field).__name__).split('.<locals>')[0]
+            taken = set(self.labels.values())
+            label, n = name, 1
+            while label in taken:
+                n += 1
+                label = f'{name}#{n}'
+            self.labels[id(field)] = label
+        return label
+
+    def seconds(self, phase):
+        return self.phases.get(phase, (0, 0.0))[1]
+
+    @property
+    def integrator(self):
+        inner = sum(seconds for phase, (_, seconds) in self.phases.items() if phase not in ('step', 'callbacks'))
+        return self.seconds('step') - inner
+
+    @property
+    def steps_per_second(self):
+        seconds = self.seconds('step')
+        return self.steps / seconds if seconds else 0.0
+
+    # Callback wrapper that times calls as 'callbacks'
+    def timed(self, phase, function):
+        def timed(*args):
+            start = perf_counter()
+            try:
+                return function(*args)
+            finally:
+                self.add(phase, perf_counter() - start)
+        return timed
+
+    def report(self):
+        lines = [f'{self.steps} steps, {self.steps_per_second:.1f} steps/s, {self.evaluations} force evaluations',
+                 f'{"phase":<24}{"calls":>10}{"total (s)":>12}{"per step (us)":>16}']
+        rows = [(phase, calls, seconds) for phase, (calls, seconds) in self.phases.items() if phase != 'step']
+        rows.append(('integrator', self.steps, self.integrator))
+        for phase, calls, seconds in sorted(rows, key=lambda row: -row[2]):
+            per_step = 1e6 * seconds / self.steps if self.steps else 0.0
+            lines.append(f'{phase:<24}{calls:>10}{seconds:>12.4f}{per_step:>16.2f}')
+        return '\n'.join(lines)
+
+    def __str__(self):
+        return self.report()
+
+# Output time k of run_until from start time t0, computed rather than
+# accumulated so that rounding does not build up; within rounding of the end
+# time t it is t itself
+def _output_time(t0, k, interval, t):
+    time = t0 + k * interval
+    return t if abs(time - t) <= 1e-9 * interval else time
+
+# Handle to row `index` of `state` without appending a row
+def _handle(cls, state, index, **attributes):
+    handle = cls.__new__(cls)
+    handle._state = state
+    handle.index = index
+    handle.__dict__.update(attributes)
+    return handle
+
+# List of handles (sim.particles, sim.springs, sim.rods). Rows added in bulk
+# get their handle from make(index) on first access, so large scenes do not
+# pay for a Python object per row; once created a handle is kept.
+class Handles:
+    def __init__(self, make):
+        self._make = make
+        self._items = []
+
+    def __len__(self):
+        return len(self._items)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[k] for k in range(*index.indices(len(self._items)))]
+        index = int(index)
+        if index < 0:
+            index += len(self._items)
+        handle = self._items[index]
+        if handle is None:
+            handle = self._items[index] = self._make(index)
+        return handle
+
+    def __iter__(self):
+        for index in range(len(self._items)):
+            yield self[index]
+
+    def append(self, handle):
+        self._items.append(handle)
+
+    # Makes room for `count` handles created on demand
+    def grow(self, count):
+        self._items.extend([None] * count)
+
+    # Follows State.remove: the handles of `rows` are detached (index None)
+    # and those of the moved rows take their new index
+    def remove(self, rows, holes, moved):
+        items = self._items
+        for row in rows:
+            if items[row] is not None:
+                items[row].index = None
+        for hole, row in zip(holes.tolist(), moved.tolist()):
+            handle = items[hole] = items[row]
+            if handle is not None:
+                handle.index = hole
+        del items[len(items) - len(rows):]
+
 class Simulation:
-    def __init__(self, dt, damping=False, dissipation_coefficient=0.5):
+    def __init__(self, dt, damping=False, dissipation_coefficient=0.5, integrator='euler', adaptive=None):
         self.dt = dt
-        self.particles = []
-        self.movable_particles = []
-        self.springs = []
+        self.state = ParticleState()
+        self.particles = Handles(self._particle)
+        self.springs = Handles(self._spring)
+        self.spring_state = SpringState()
+        self.rods = Handles(self._rod)
+        self.rod_state = RodState()
         self.fields = []
+        self.batch_fields = []
         self.time = 0.0
         self.damping = damping
         self.dissipation_coefficient = dissipation_coefficient
+        self.integrator = integrator
+        self.adaptive = adaptive
+        self.recorders = []
+        self.stats = None
+        self.topology_version = 0
+
+    @property
+    def integrator(self):
+        return self._integrator
+
+    # Accepts an integrator object or one of the names in INTEGRATORS
+    @integrator.setter
+    def integrator(self, value):
+        if isinstance(value, str):
+            if value not in INTEGRATORS:
+                raise ValueError(f"unknown integrator {value!r}, choose from {sorted(INTEGRATORS)}")
+            value = INTEGRATORS[value]()
+        self._integrator = value
+
+    # Per-particle property columns, {name: (N, ...) array}, handed to every
+    # batched field. Assigning a whole dict replaces all columns.
+    @property
+    def properties(self):
+        return self.state.properties
+
+    @properties.setter
+    def properties(self, values):
+        self.state.properties.clear()
+        self.state.properties.update(values)
+
+    # Declares a property column; particles added later start at `default`.
+    # Attributes of that name already set on particle handles move into the
+    # column. Returns the column (sim.properties[name] is always current).
+    def add_property(self, name, dtype=float, default=0.0, shape=()):
+        column = self.state.declare(name, dtype, default, shape)
+        for particle in self.particles._items:
+            if particle is not None and name in particle.__dict__:
+                value = particle.__dict__.pop(name)
+                if value is not None:
+                    column[particle.index] = value
+        return column
+
+    @property
+    def movable_particles(self):
+        return [p for p, m in zip(self.particles, self.state.movable) if m]
 
     def add_particle(self, mass, position, velocity=None, movable=True, properties=None):
-        if velocity is None:
-            velocity = np.zeros(3)
-        particle = Particle(mass, position, velocity, movable, properties)
+        particle = Particle(mass, position, velocity, movable, properties, state=self.state)
         self.particles.append(particle)
-        if movable:
-            self.movable_particles.append(particle)
         return particle
 
-    def add_spring(self, p1, p2, k, L0=None):
-        spring = Spring(p1, p2, k, L0)
+    # max_strain: the spring breaks once stretched past (1 + max_strain) L0
+    def add_spring(self, p1, p2, k, L0=None, max_strain=None):
+        spring = Spring(p1, p2, k, L0, state=self.spring_state)
+        if max_strain is not None:
+            spring.max_strain = max_strain
         self.springs.append(spring)
         return spring
 
+    # Bulk versions of add_particle and add_spring, taking arrays (masses,
+    # stiffnesses, rest lengths and movable flags may be scalars). `properties`
+    # holds values for declared property columns. Springs connect particle
+    # indices i[n] and j[n], with rest lengths defaulting to the current
+    # distances. Both return the indices of the new rows; their handles in
+    # sim.particles / sim.springs are created on first access.
+    def add_particles(self, masses, positions, velocities=None, movable=True, properties=None):
+        positions = np.asarray(positions, float).reshape(-1, 3)
+        start = self.state.extend(masses, positions, velocities, movable, properties)
+        self.particles.grow(len(positions))
+        return np.arange(start, start + len(positions))
+
+    def add_springs(self, i, j, k, L0=None, max_strain=np.inf):
+        i, j = np.broadcast_arrays(np.asarray(i, np.intp), np.asarray(j, np.intp))
+        i, j = i.ravel(), j.ravel()
+        if len(i) and (min(i.min(), j.min()) < 0 or max(i.max(), j.max()) >= self.state.count):
+            raise IndexError("spring endpoint out of range")
+        if L0 is None:
+            axis = self.state.pos[j] - self.state.pos[i]
+            L0 = np.sqrt(np.einsum('ij,ij->i', axis, axis))
+        start = self.spring_state.extend(i, j, k, L0, max_strain)
+        self.springs.grow(len(i))
+        return np.arange(start, start + len(i))
+
+    # Topology changes. Removed rows are filled with the last rows of the
+    # arrays, so the arrays stay compact and removing m elements moves O(m)
+    # data (plus one pass over the springs and rods to renumber their
+    # endpoints when particles are removed). Handles of moved elements follow
+    # their rows; handles of removed ones get index None. Elements are given
+    # as indices or handles.
+    def remove_springs(self, springs):
+        self._remove(self.spring_state, self.springs, self._rows(springs, self.spring_state.count))
+
+    def remove_rods(self, rods):
+        self._remove(self.rod_state, self.rods, self._rows(rods, self.rod_state.count))
+
+    # Removes particles together with their springs and rods. Returns the
+    # (old N,) map from old to new particle indices, -1 for removed ones.
+    def remove_particles(self, particles):
+        n = self.state.count
+        rows = self._rows(particles, n)
+        dead = np.zeros(n, bool)
+        dead[rows] = True
+        for state, handles in ((self.spring_state, self.springs), (self.rod_state, self.rods)):
+            attached = np.flatnonzero(dead[state.i] | dead[state.j])
+            if attached.size:
+                self._remove(state, handles, attached)
+        holes, moved = self._remove(self.state, self.particles, rows)
+        remap = np.arange(n)
+        remap[rows] = -1
+        remap[moved] = holes
+        for state in (self.spring_state, self.rod_state):
+            state.i[:] = remap[state.i]
+            state.j[:] = remap[state.j]
+        return remap
+
+    # Removes the springs stretched past their max_strain; returns how many.
+    # Every step starts with this when any spring is breakable, so the
+    # topology stays fixed within a step for all integrators and for the
+    # trial steps of the adaptive stepper.
+    def break_springs(self):
+        springs = self.spring_state
+        rows = springs.strained(self.state.pos)
+        if rows.size:
+            self._remove(springs, self.springs, rows)
+            springs.broken += rows.size
+        return rows.size
+
+    def _rows(self, items, count):
+        if isinstance(items, np.ndarray) and items.dtype != object:
+            rows = np.unique(items.astype(np.intp))
+        else:
+            rows = np.unique(np.array([getattr(item, 'index', item) for item in np.ravel(np.array(items, object))],
+                                      np.intp))
+        if rows.size and (rows[0] < 0 or rows[-1] >= count):
+            raise IndexError("index out of range")
+        return rows
+
+    def _remove(self, state, handles, rows):
+        holes, moved = state.remove(rows)
+        handles.remove(rows, holes, moved)
+        self.topology_version += 1
+        if hasattr(self._integrator, 'reset'):
+            self._integrator.reset()
+        return holes, moved
+
+    def _particle(self, index):
+        if 'type' in self.state._columns:
+            return _handle(Particle, self.state, index)
+        return _handle(Particle, self.state, index, type=None)
+
+    def _spring(self, index):
+        rows = self.spring_state
+        return _handle(Spring, rows, index, p1=self.particles[rows.i[index]], p2=self.particles[rows.j[index]])
+
+    def _rod(self, index):
+        rows = self.rod_state
+        return _handle(Rod, rows, index, p1=self.particles[rows.i[index]], p2=self.particles[rows.j[index]])
+
+    # Rigid rod of fixed length (default: the current distance), enforced by the
+    # SHAKE/RATTLE solver in sim.rod_state after every unconstrained step
+    def add_rod(self, p1, p2, length=None):
+        if length is None:
+            length = vnorm(p2.pos - p1.pos)
+        rod = Rod(p1, p2, length, self.rod_state)
+        self.rods.append(rod)
+        return rod
+
+    # Attaches a recorder (see recorder.py), which records the current state and
+    # is then called with recorder.step(sim) after every step
+    def add_recorder(self, recorder):
+        self.recorders.append(recorder)
+        recorder.record(self)
+        return recorder
+
     def add_field(self, function):
         self.fields.append(function)
 
+    def add_batch_field(self, function):
+        self.batch_fields.append(function)
+
+    def update_batch_fields(self, groups=None):
+        state = self.state
+        for field in self.batch_fields:
+            if groups is None or field in groups:
+                state.acc += field(state.pos, state.vel, state.mass, self.properties, self.time)
+
     def update_particle(self, particle):
         for field in self.fields:
             particle.acc += field(particle)
 
-        particle.update(self.dt)
-        particle.acc[:] = 0.0
-
     def update_spring(self, spring):
         spring_axis = spring.axis()
         force = spring.force(spring_axis)
@@ -105,14 +1307,329 @@ class Simulation:
             spring.p1.acc += force / spring.p1.mass
             spring.p2.acc -= force / spring.p2.mass
 
+    # All springs in one batched pass, scattered into the particle accelerations
+    def update_springs(self):
+        springs = self.spring_state
+        if not springs.count:
+            return
+        state = self.state
+        b = self.dissipation_coefficient if self.damping else None
+        F = springs.forces(state.pos, state.vel, b)
+        i, j = springs.i, springs.j
+        scatter_add(state.acc, np.concatenate((i, j)),
+                    np.concatenate((F / state.mass[i, None], -F / state.mass[j, None])))
+
+    # Fills state.acc with the accelerations from springs and fields at the
+    # current positions, velocities and time. `groups` restricts them to some
+    # force groups: 'springs', 'fields' (the per-particle fields) and the
+    # batched field objects themselves.
+    def compute_accelerations(self, groups=None):
+        if self.stats is not None:
+            return self._timed_accelerations(groups)
+        self.state.acc[:] = 0.0
+        if groups is None or 'springs' in groups:
+            self.update_springs()
+        self.update_batch_fields(groups)
+        if self.fields and (groups is None or 'fields' in groups):
+            for particle in self.movable_particles:
+                self.update_particle(particle)
+        return self.state.acc
+
+    # compute_accelerations with every phase timed into self.stats
+    def _timed_accelerations(self, groups=None):
+        stats = self.stats
+        state = self.state
+        state.acc[:] = 0.0
+        if groups is None or 'springs' in groups:
+            start = perf_counter()
+            self.update_springs()
+            stats.add('springs', perf_counter() - start)
+        for field in self.batch_fields:
+            if groups is None or field in groups:
+                start = perf_counter()
+                state.acc += field(state.pos, state.vel, state.mass, self.properties, self.time)
+                stats.add(stats.label(field), perf_counter() - start)
+        if self.fields and (groups is None or 'fields' in groups):
+            # One field at a time over all particles, so each is timed on its own
+            particles = self.movable_particles
+            for field in self.fields:
+                start = perf_counter()
+                for particle in particles:
+                    particle.acc += field(particle)
+                stats.add(stats.label(field), perf_counter() - start)
+        stats.evaluations += 1
+        return state.acc
+
+    # Times the enclosed block: stats are collected into a fresh
+    # SimulationStats, which is yielded, and the previous setting is restored
+    # afterwards
+    @contextmanager
+    def profile(self):
+        previous, self.stats = self.stats, SimulationStats()
+        try:
+            yield self.stats
+        finally:
+            self.stats = previous
+
+    # Force groups with something to compute, in the order used above
+    def force_groups(self):
+        groups = ['springs'] if self.spring_state.count else []
+        groups += self.batch_fields
+        if self.fields:
+            groups.append('fields')
+        return groups
+
+    # Advances by one step of size dt, including the rod constraints
+    def step(self, dt):
+        if self.rod_state.count:
+            ref = self.state.pos.copy()
+            self._integrator.step(self, dt)
+            if self.stats is None:
+                self.rod_state.constrain(self.state, ref, dt)
+            else:
+                start = perf_counter()
+                self.rod_state.constrain(self.state, ref, dt)
+                self.stats.add('rods', perf_counter() - start)
+        else:
+            self._integrator.step(self, dt)
+
+    # One step of sim.dt, or with an AdaptiveStepper in sim.adaptive one accepted
+    # step after which sim.dt holds the proposed size of the next one
     def update(self):
-        self.time += self.dt
-        for spring in self.springs:
-            self.update_spring(spring)
-        for particle in self.movable_particles:
-            self.update_particle(particle)
+        stats = self.stats
+        if stats is not None:
+            start = perf_counter()
+        if self.spring_state.breakable:
+            self.break_springs()
+        if self.adaptive is None:
+            self.step(self.dt)
+        else:
+            _, self.dt = self.adaptive.step(self, self.dt)
+        if self.recorders:
+            self._record(stats)
+        if stats is not None:
+            stats.steps += 1
+            stats.add('step', perf_counter() - start)
+
+    def _record(self, stats):
+        if stats is not None:
+            start = perf_counter()
+        for recorder in self.recorders:
+            recorder.step(self)
+        if stats is not None:
+            stats.add('recorders', perf_counter() - start)
+
+    # Advances `n_steps` steps inside the engine. If a callback is given it is
+    # called as callback(sim) after every `every` steps; returning True from it
+    # stops the run early. Returns the number of steps taken.
+    def run(self, n_steps, callback=None, every=1):
+        update = self.update
+        if callback is not None and self.stats is not None:
+            callback = self.stats.timed('callbacks', callback)
+        if callback is None:
+            for _ in range(n_steps):
+                update()
+            return n_steps
+        done = 0
+        while done + every <= n_steps:
+            for _ in range(every):
+                update()
+            done += every
+            if callback(self):
+                return done
+        for _ in range(n_steps - done):
+            update()
+        return n_steps
+
+    # Advances until sim.time reaches `t`. The callback runs after every `every`
+    # steps, or, if `interval` is given, at the fixed times time + k * interval
+    # (for a fixed dt the interval is rounded to a whole number of steps; in
+    # adaptive mode steps are shortened to land on the output times, and on
+    # those of recorders with a `next_time`, exactly; an output time within
+    # rounding of `t` is taken to be `t`).
+    def run_until(self, t, callback=None, every=1, interval=None):
+        if self.adaptive is None:
+            if interval is not None:
+                every = max(1, int(round(interval / self.dt)))
+            n_steps = max(0, int(np.ceil((t - self.time) / self.dt - 1e-9)))
+            return self.run(n_steps, callback, every)
+        adaptive = self.adaptive
+        stats = self.stats
+        if callback is not None and stats is not None:
+            callback = stats.timed('callbacks', callback)
+        steps = 0
+        t0 = self.time
+        outputs = 1
+        next_output = np.inf
+        if interval is not None:
+            next_output = _output_time(t0, outputs, interval, t)
+        while self.time < t:
+            if stats is not None:
+                start = perf_counter()
+            target = min(t, next_output)
+            for recorder in self.recorders:
+                time = getattr(recorder, 'next_time', np.inf)
+                if self.time < time < target:
+                    target = time
+            dt = min(self.dt, target - self.time)
+            if self.spring_state.breakable:
+                self.break_springs()
+            taken, proposed = adaptive.step(self, dt)
+            steps += 1
+            if taken == dt and dt < self.dt:
+                self.time = target
+                self.dt = max(self.dt, proposed)
+            else:
+                self.dt = proposed
+            if self.recorders:
+                self._record(stats)
+            if stats is not None:
+                stats.steps += 1
+                stats.add('step', perf_counter() - start)
+            if callback is None:
+                continue
+            if interval is None:
+                if steps % every == 0 and callback(self):
+                    break
+            elif self.time >= next_output:
+                outputs += 1
+                next_output = _output_time(t0, outputs, interval, t)
+                if callback(self):
+                    break
+        return steps
+
+    # Writes particles, springs, rods, properties, time and settings to `path`
+    # (see write_checkpoint). Fields, recorders and the adaptive stepper are
+    # not saved, and the integrator is restored by name with default settings.
+    # With background=True only the arrays are copied here, into `buffers`
+    # (a dict reused between calls) if given; a thread, which is returned,
+    # writes the file.
+    def save_checkpoint(self, path, background=False, buffers=None):
+        state, springs, rods = self.state, self.spring_state, self.rod_state
+        meta = {
+            'time': self.time,
+            'dt': self.dt,
+            'damping': self.damping,
+            'dissipation_coefficient': self.dissipation_coefficient,
+            'integrator': next((name for name, cls in INTEGRATORS.items() if type(self._integrator) is cls), None),
+            'rod_settings': [rods.tol, rods.max_iter, rods.dense_limit],
+            'property_defaults': {name: np.asarray(default).tolist() for name, default in state.defaults.items()},
+        }
+        arrays = {
+            'pos': state.pos, 'vel': state.vel, 'mass': state.mass, 'movable': state.movable,
+            'spring_i': springs.i, 'spring_j': springs.j, 'spring_k': springs.k, 'spring_L0': springs.L0,
+            'spring_limit': springs.limit,
+            'rod_i': rods.i, 'rod_j': rods.j, 'rod_length': rods.length,
+        }
+        arrays.update({'property:' + name: np.asarray(value) for name, value in self.properties.items()})
+        particles = list(self.particles._items)
+
+        # Handles not created yet only have the default type, unless type is a
+        # property column
+        default = {} if 'type' in state._columns else {'type': None}
+
+        def write():
+            extras = [{k: v for k, v in p.__dict__.items() if k not in ('_state', 'index')}
+                      if p is not None else default for p in particles]
+            meta['particle_attributes'] = None if all(e == default for e in extras) else extras
+            write_checkpoint(path, meta, arrays)
+
+        if not background:
+            write()
+            return None
+        buffers = {} if buffers is None else buffers
+        for name, a in arrays.items():
+            buffer = buffers.get(name)
+            if buffer is None or buffer.shape != a.shape or buffer.dtype != a.dtype:
+                buffer = buffers[name] = np.empty_like(a)
+            np.copyto(buffer, a)
+            arrays[name] = buffer
+        thread = threading.Thread(target=write, daemon=True)
+        thread.start()
+        return thread
+
+    # Rebuilds a Simulation from a checkpoint; keyword arguments (e.g.
+    # integrator) override the saved settings
+    @classmethod
+    def load_checkpoint(cls, path, **kwargs):
+        meta, arrays = read_checkpoint(path)
+        settings = {name: meta[name] for name in ('dt', 'damping', 'dissipation_coefficient')}
+        if meta['integrator'] is not None:
+            settings['integrator'] = meta['integrator']
+        settings.update(kwargs)
+        sim = cls(**settings)
+        sim.time = meta['time']
+        state = sim.state
+        n = len(arrays['mass'])
+        state.reserve(n)
+        state.count = n
+        state._views()
+        for name in ('pos', 'vel', 'mass', 'movable'):
+            getattr(state, name)[:] = arrays[name]
+        # Columns first, so the handles read them rather than their defaults
+        for name, default in meta.get('property_defaults', {}).items():
+            value = arrays['property:' + name]
+            state.declare(name, value.dtype, default, value.shape[1:])
+        for name, value in arrays.items():
+            if name.startswith('property:'):
+                sim.properties[name[9:]] = value
+        if meta['particle_attributes'] is None:
+            sim.particles.grow(n)
+        else:
+            for index, extra in enumerate(meta['particle_attributes']):
+                extra = {k: v for k, v in extra.items() if k not in state._columns}
+                sim.particles.append(_handle(Particle, state, index, **extra))
+
+        def restore(rows, prefix, names, handles):
+            count = len(arrays[prefix + 'i'])
+            rows.reserve(count)
+            rows.count = count
+            rows._views()
+            for name in names:
+                if prefix + name in arrays:
+                    getattr(rows, name)[:] = arrays[prefix + name]
+            handles.grow(count)
+
+        restore(sim.spring_state, 'spring_', ('i', 'j', 'k', 'L0', 'limit'), sim.springs)
+        sim.spring_state.breakable = bool(np.isfinite(sim.spring_state.limit).any())
+        restore(sim.rod_state, 'rod_', ('i', 'j', 'length'), sim.rods)
+        sim.rod_state.tol, sim.rod_state.max_iter, sim.rod_state.dense_limit = meta['rod_settings']
+        return sim
 
     def get_energy(self):
-        kinetic = sum(p.energy() for p in self.particles)
-        potential = sum(s.energy() for s in self.springs)
+        state = self.state
+        kinetic = 0.5 * np.dot(state.mass, np.einsum('ij,ij->i', state.vel, state.vel))
+        potential = self.spring_state.energy(state.pos)
         return (kinetic, potential)
+
+    # Potential energy of the batched fields that provide energy()
+    def get_field_energy(self):
+        state = self.state
+        return sum(field.energy(state.pos, state.mass, self.properties)
+                   for field in self.batch_fields if hasattr(field, 'energy'))
+
+# Writes a checkpoint every `every` steps when attached with sim.add_recorder
+# (and once on attaching). Writes happen in the background, reusing the same
+# snapshot buffers; a new one first waits for the previous write to finish.
+class Checkpointer:
+    def __init__(self, path, every, background=True):
+        self.path = path
+        self.every = every
+        self.background = background
+        self.steps = 0
+        self.thread = None
+        self.buffers = {}
+
+    def record(self, sim):
+        self.close()
+        self.thread = sim.save_checkpoint(self.path, self.background, self.buffers)
+
+    def step(self, sim):
+        self.steps += 1
+        if self.steps % self.every == 0:
+            self.record(sim)
+
+    def close(self):
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
@@ -0,0 +1,182 @@
+import json
+import os
+import numpy as np
+from numpy.lib.format import open_memmap
+
+# Trajectories on disk: every recorded quantity is split into chunks of
+# `chunk` frames, each a preallocated .npy file that is written and read
+# through memory maps,
+#   directory/index.json          frame count, chunk size, shapes and dtypes
+#   directory/topology.npz        masses, movable flags and spring / rod pairs
+#   directory/topology-<frame>.npz  the same, from a frame on which springs or
+#                                 rods had been removed (sim.topology_version)
+#   directory/<name>-00000.npy    frames 0 .. chunk-1 of <name>
+#   directory/<name>-00001.npy    ...
+# so appending a frame is O(1) and any frame range can be read without loading
+# the rest of the run.
+
+# Read access to a recorded trajectory
+class Trajectory:
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'index.json')) as f:
+            index = json.load(f)
+        self.frames = index['frames']
+        self.chunk = index['chunk']
+        self.fields = {name: (tuple(shape), np.dtype(dtype)) for name, (shape, dtype) in index['fields'].items()}
+        self._chunks = {}
+        self.changes = index.get('topologies', [])
+        self.interval = index.get('interval')
+        path = os.path.join(directory, 'topology.npz')
+        self.topology = dict(np.load(path)) if os.path.exists(path) else None
+
+    def __len__(self):
+        return self.frames
+
+    def path(self, name, chunk):
+        return os.path.join(self.directory, f'{name}-{chunk:05d}.npy')
+
+    def _chunk(self, name, chunk):
+        key = (name, chunk)
+        if key not in self._chunks:
+            self._chunks[key] = np.load(self.path(name, chunk), mmap_mode='r')
+        return self._chunks[key]
+
+    # Frames start .. stop-1 of `name` (negative indices count from the end)
+    def read(self, name, start=0, stop=None):
+        start, stop, _ = slice(start, stop).indices(self.frames)
+        shape, dtype = self.fields[name]
+        out = np.empty((max(stop - start, 0),) + shape, dtype)
+        for chunk in range(start // self.chunk, -(-stop // self.chunk)):
+            lo = max(start, chunk * self.chunk)
+            hi = min(stop, (chunk + 1) * self.chunk)
+            out[lo - start:hi - start] = self._chunk(name, chunk)[lo - chunk * self.chunk:hi - chunk * self.chunk]
+        return out
+
+    # The topology in effect at `frame`
+    def topology_at(self, frame):
+        start, stop, _ = slice(frame, frame + 1).indices(self.frames)
+        changed = [f for f in self.changes if f <= start]
+        if not changed:
+            return self.topology
+        return dict(np.load(os.path.join(self.directory, f'topology-{changed[-1]:08d}.npz')))
+
+    # All recorded quantities of one frame
+    def frame(self, index):
+        return {name: self.read(name, index, index + 1 if index != -1 else None)[0] for name in self.fields}
+
+# Streams a Simulation to disk. Attach it with sim.add_recorder(recorder): it
+# records the current state at once and then every `every` steps, or, if
+# `interval` is given, at the fixed times start + k * interval (`interval` is
+# saved in the index). Under an AdaptiveStepper, sim.run_until shortens steps
+# to land on those times exactly; otherwise a frame is recorded at the first
+# step at or past each output time. `fields`
+# picks from 'pos', 'vel' and 'energy' (kinetic, potential); `observables`
+# adds {name: function(sim)} arrays of a fixed shape. The time is always kept
+# in float64, everything else in `dtype` (e.g. np.float32 to halve the size).
+# index.json is rewritten whenever a chunk fills up and on flush(), which is
+# when other processes see the new frames. Springs and rods may be removed
+# during the recording, but every quantity must keep its shape, so a run that
+# adds or removes particles needs a new recorder afterwards.
+class TrajectoryRecorder(Trajectory):
+    def __init__(self, directory, every=1, fields=('pos', 'vel'), observables=None, dtype=np.float64, chunk=1024,
+                 interval=None):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.every = every
+        self.interval = interval
+        self.start = None
+        self.next_time = np.inf
+        self.chunk = chunk
+        self.dtype = np.dtype(dtype)
+        getters = {
+            'pos': lambda sim: sim.state.pos,
+            'vel': lambda sim: sim.state.vel,
+            'energy': lambda sim: sim.get_energy(),
+        }
+        self.getters = {name: getters[name] for name in fields}
+        self.getters.update(observables or {})
+        self.frames = 0
+        self.fields = None
+        self.topology = None
+        self.changes = []
+        self.version = None
+        self.steps = 0
+        self._chunks = {}
+        self._open = {}
+
+    def _chunk(self, name, chunk):
+        if self._open and chunk == (self.frames - 1) // self.chunk:
+            return self._open[name]
+        return super()._chunk(name, chunk)
+
+    def record(self, sim):
+        if self.start is None:
+            self.start = sim.time
+            if self.interval is not None:
+                self.next_time = sim.time + self.interval
+        values = {'time': sim.time}
+        for name, getter in self.getters.items():
+            values[name] = np.asarray(getter(sim))
+        if self.fields is None:
+            self.fields = {name: (np.shape(value), np.dtype(float) if name == 'time' else self.dtype)
+                           for name, value in values.items()}
+        for name, value in values.items():
+            if np.shape(value) != self.fields[name][0]:
+                raise ValueError(f"{name!r} changed shape from {self.fields[name][0]} to {np.shape(value)}; "
+                                 "start a new recorder after adding or removing particles")
+        version = getattr(sim, 'topology_version', 0)
+        if version != self.version:
+            topology = {
+                'mass': sim.state.mass.copy(), 'movable': sim.state.movable.copy(),
+                'spring_i': sim.spring_state.i.copy(), 'spring_j': sim.spring_state.j.copy(),
+                'rod_i': sim.rod_state.i.copy(), 'rod_j': sim.rod_state.j.copy(),
+            }
+            if self.topology is None:
+                self.topology = topology
+                np.savez(os.path.join(self.directory, 'topology.npz'), **topology)
+            else:
+                np.savez(os.path.join(self.directory, f'topology-{self.frames:08d}.npz'), **topology)
+                self.changes.append(self.frames)
+            self.version = version
+        chunk, row = divmod(self.frames, self.chunk)
+        if row == 0:
+            self.flush()
+            self._open = {name: open_memmap(self.path(name, chunk), 'w+', dtype, (self.chunk,) + shape)
+                          for name, (shape, dtype) in self.fields.items()}
+        for name, value in values.items():
+            self._open[name][row] = value
+        self.frames += 1
+
+    # Called by the simulation after every step
+    def step(self, sim):
+        self.steps += 1
+        if self.interval is None:
+            if self.steps % self.every == 0:
+                self.record(sim)
+        elif sim.time >= self.next_time - 1e-9 * self.interval:
+            self.record(sim)
+            outputs = np.floor((sim.time - self.start) / self.interval + 1e-9) + 1
+            self.next_time = self.start + outputs * self.interval
+
+    def flush(self):
+        for out in self._open.values():
+            out.flush()
+        if self.fields is None:
+            return
+        index = {
+            'frames': self.frames,
+            'chunk': self.chunk,
+            'fields': {name: [list(shape), dtype.str] for name, (shape, dtype) in self.fields.items()},
+            'topologies': self.changes,
+            'interval': self.interval,
+        }
+        path = os.path.join(self.directory, 'index.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(index, f)
+        os.replace(path + '.tmp', path)
+
+    def close(self):
+        self.flush()
+        self._open = {}
+        self._chunks = {}
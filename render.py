@@ -0,0 +1,234 @@
+import os
+import struct
+import zlib
+import numpy as np
+
+# Headless software renderer: particles as shaded discs and springs as lines,
+# projected with a pinhole (or orthographic) camera and rasterized with numpy
+# into (height, width, 3) uint8 images. No GUI or browser is involved, so it
+# runs on servers and inside run-loop callbacks.
+
+def _normalize(v):
+    v = np.asarray(v, float)
+    return v / np.linalg.norm(v)
+
+# (S, 2) index pairs of the springs followed by the rods
+def _pairs(spring_i, spring_j, rod_i, rod_j):
+    return np.column_stack((np.concatenate((spring_i, rod_i)), np.concatenate((spring_j, rod_j)))).astype(int)
+
+# Indices start, start+1, ..., start+count-1 for every (start, count) pair,
+# with the pair each index came from
+def _ranges(counts):
+    owner = np.repeat(np.arange(len(counts)), counts)
+    offsets = np.arange(owner.size) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owner, offsets
+
+# Camera at `eye` looking at `target`, with `up` pointing up on screen
+# (physics coordinates, z up by default). fov is the vertical field of view in
+# degrees; with orthographic=True `height` world units fit vertically instead.
+class Camera:
+    def __init__(self, eye=(0.0, -10.0, 4.0), target=(0.0, 0.0, 0.0), up=(0.0, 0.0, 1.0), fov=40.0,
+                 orthographic=False, height=5.0, near=1e-3):
+        self.eye = np.asarray(eye, float)
+        self.target = np.asarray(target, float)
+        self.up = np.asarray(up, float)
+        self.fov = fov
+        self.orthographic = orthographic
+        self.height = height
+        self.near = near
+
+    # Pixel coordinates (u right, v down), depth along the view axis and pixels
+    # per world unit at each point, for an image `width` x `height` pixels
+    def project(self, pos, width, height):
+        forward = _normalize(self.target - self.eye)
+        right = _normalize(np.cross(forward, self.up))
+        up = np.cross(right, forward)
+        rel = pos - self.eye
+        x, y, depth = rel @ right, rel @ up, rel @ forward
+        if self.orthographic:
+            scale = np.full(len(pos), height / self.height)
+        else:
+            focal = 0.5 * height / np.tan(np.radians(self.fov) / 2)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                scale = focal / depth
+        u = 0.5 * width + x * scale
+        v = 0.5 * height - y * scale
+        return u, v, depth, scale
+
+# Renders position arrays. `pairs` is an (S, 2) array of particle indices to
+# connect with lines (springs, rods); `radius` is the world-space particle
+# radius, scalar or per particle; colors are RGB tuples, or (N, 3) arrays for
+# per-particle colors.
+class Renderer:
+    def __init__(self, width=640, height=480, camera=None, pairs=None, radius=0.05,
+                 particle_color=(40, 90, 220), spring_color=(150, 150, 150), background=(255, 255, 255),
+                 line_width=1):
+        self.width = width
+        self.height = height
+        self.camera = Camera() if camera is None else camera
+        self.pairs = np.zeros((0, 2), int) if pairs is None else np.asarray(pairs, int).reshape(-1, 2)
+        self.radius = radius
+        self.particle_color = np.asarray(particle_color, np.uint8)
+        self.spring_color = np.asarray(spring_color, np.uint8)
+        self.background = np.asarray(background, np.uint8)
+        self.line_width = line_width
+        self.simulation = None
+        self.version = None
+
+    # Renderer for the springs and rods of a Simulation, with the particle radii
+    # scaled by the cube root of the mass like in Visualization. The pairs and
+    # radii are read again whenever sim.topology_version changes, so broken or
+    # removed springs and removed particles disappear.
+    @classmethod
+    def from_simulation(cls, sim, radius=0.05, **kwargs):
+        renderer = cls(**kwargs)
+        renderer.simulation = sim
+        renderer.particle_radius = radius
+        renderer.follow()
+        return renderer
+
+    def follow(self):
+        sim = self.simulation
+        if sim is None or self.version == sim.topology_version:
+            return
+        self.pairs = _pairs(sim.spring_state.i, sim.spring_state.j, sim.rod_state.i, sim.rod_state.j)
+        self.radius = self.particle_radius * np.cbrt(sim.state.mass)
+        self.version = sim.topology_version
+
+    def render(self, pos):
+        self.follow()
+        w, h = self.width, self.height
+        image = np.empty((h * w, 3), np.uint8)
+        image[:] = self.background
+        u, v, depth, scale = self.camera.project(np.asarray(pos, float), w, h)
+        visible = depth > self.camera.near
+
+        # Fragments (pixel, depth, color) of the discs and lines. A depth
+        # buffer (a per-pixel minimum) keeps the nearest fragment of every
+        # pixel, and ties go to the earliest fragment, so discs win over lines.
+        pixels, depths, colors = [], [], []
+
+        # Discs shaded darker towards the rim, at the depth of the sphere's
+        # front surface so they cover lines ending at their centres. Only the
+        # part of each disc inside the image is rasterized, so discs of
+        # particles close to the camera stay bounded by the image size.
+        radius = np.broadcast_to(self.radius, u.shape)
+        r = radius * scale
+        idx = np.flatnonzero(visible & (r > 0))
+        if idx.size:
+            cx, cy = np.rint(u[idx]), np.rint(v[idx])
+            rr = np.minimum(np.maximum(np.ceil(r[idx]), 1), w + h)
+            x0, y0 = np.maximum(cx - rr, 0), np.maximum(cy - rr, 0)
+            nx = np.maximum(np.minimum(cx + rr, w - 1) - x0 + 1, 0).astype(int)
+            ny = np.maximum(np.minimum(cy + rr, h - 1) - y0 + 1, 0).astype(int)
+            owner, k = _ranges(nx * ny)
+            x = x0[owner] + k % nx[owner]
+            y = y0[owner] + k // nx[owner]
+            ox, oy = x - cx[owner], y - cy[owner]
+            d2 = (ox * ox + oy * oy) / np.maximum(r[idx][owner], 0.5)**2
+            inside = d2 <= 1
+            owner, d2 = owner[inside], d2[inside]
+            color = self.particle_color
+            color = color[idx][owner] if color.ndim == 2 else np.broadcast_to(color, (owner.size, 3))
+            pixels.append((y * w + x)[inside].astype(np.intp))
+            depths.append(depth[idx][owner] - radius[idx][owner] * np.sqrt(1 - d2))
+            colors.append((color * (1 - 0.45 * d2)[:, None]).astype(np.uint8))
+
+        # Lines, with the depth interpolated along them
+        i, j = self.pairs.T
+        keep = visible[i] & visible[j]
+        if keep.any():
+            i, j = i[keep], j[keep]
+            du, dv = u[j] - u[i], v[j] - v[i]
+            counts = np.minimum(np.ceil(np.maximum(np.abs(du), np.abs(dv))), 4 * (w + h)).astype(int) + 1
+            owner, k = _ranges(counts)
+            t = k / np.maximum(counts[owner] - 1, 1)
+            x = np.rint(u[i][owner] + t * du[owner])
+            y = np.rint(v[i][owner] + t * dv[owner])
+            z = depth[i][owner] + t * (depth[j] - depth[i])[owner]
+            if self.line_width > 1:
+                offsets = np.arange(self.line_width) - self.line_width // 2
+                ox, oy = np.meshgrid(offsets, offsets)
+                x = (x[:, None] + ox.ravel()).ravel()
+                y = (y[:, None] + oy.ravel()).ravel()
+                z = np.repeat(z, ox.size)
+            inside = (x >= 0) & (x < w) & (y >= 0) & (y < h)
+            pixels.append((y * w + x)[inside].astype(np.intp))
+            depths.append(z[inside])
+            colors.append(np.broadcast_to(self.spring_color, (inside.sum(), 3)))
+
+        if pixels:
+            pixels, depths, colors = np.concatenate(pixels), np.concatenate(depths), np.concatenate(colors)
+            nearest = np.full(w * h, np.inf)
+            np.minimum.at(nearest, pixels, depths)
+            hits = np.flatnonzero(depths == nearest[pixels])
+            winner = np.full(w * h, pixels.size)
+            np.minimum.at(winner, pixels[hits], hits)
+            drawn = np.flatnonzero(winner < pixels.size)
+            image[drawn] = colors[winner[drawn]]
+        return image.reshape(h, w, 3)
+
+def write_png(path, image, level=1):
+    h, w, _ = image.shape
+    raw = np.zeros((h, 1 + 3 * w), np.uint8)
+    raw[:, 1:] = image.reshape(h, 3 * w)
+
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', w, h, 8, 2, 0, 0, 0)))
+        f.write(chunk(b'IDAT', zlib.compress(raw.tobytes(), level)))
+        f.write(chunk(b'IEND', b''))
+
+# Writes rendered frames either as a PNG sequence (`path` a pattern such as
+# 'frames/{:05d}.png') or, with raw=True, appended to one file of raw RGB24
+# frames, e.g. for
+#   ffmpeg -f rawvideo -pix_fmt rgb24 -s WxH -r 30 -i frames.rgb out.mp4
+# Calling the writer with a Simulation renders its current positions, so it
+# can be passed as a run() callback.
+class FrameWriter:
+    def __init__(self, renderer, path, raw=False):
+        self.renderer = renderer
+        self.path = path
+        self.raw = raw
+        self.frames = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(path, 'wb') if raw else None
+
+    def write(self, pos):
+        image = self.renderer.render(pos)
+        if self.raw:
+            self.file.write(image.tobytes())
+        else:
+            write_png(self.path.format(self.frames), image)
+        self.frames += 1
+
+    def __call__(self, sim):
+        self.write(sim.state.pos)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+# Renders frames start, start+step, ... of a recorded trajectory
+# (recorder.Trajectory); returns the number of frames written. If springs or
+# rods were removed during the recording, the renderer's pairs follow the
+# topology of every frame (Trajectory.topology_at).
+def render_trajectory(trajectory, writer, start=0, stop=None, step=1):
+    start, stop, step = slice(start, stop, step).indices(len(trajectory))
+    current = None
+    for frame in range(start, stop, step):
+        if trajectory.changes and trajectory.topology is not None:
+            change = max([f for f in trajectory.changes if f <= frame], default=0)
+            if change != current:
+                topology = trajectory.topology_at(frame)
+                writer.renderer.pairs = _pairs(topology['spring_i'], topology['spring_j'],
+                                               topology['rod_i'], topology['rod_j'])
+                current = change
+        writer.write(trajectory.read('pos', frame, frame + 1)[0])
+    return len(range(start, stop, step))
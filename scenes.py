@@ -0,0 +1,99 @@
+import numpy as np
+from physics import Simulation, uniform_field
+from interactions import Coulomb, Gravity
+from lattice import grid, grid_edges, grid_border, spring_network
+
+# Headless builders for the scenes of the bundled examples, with the same
+# default parameters. Every builder returns a ready-to-run Simulation; extra
+# keyword arguments (e.g. integrator) are passed on to Simulation.
+
+# 2D membrane of NX x NY particles with a clamped border (wave_propagation.py).
+# Instead of the harmonic drive, the centre node starts displaced by `pulse`.
+def wave_grid(nx=30, ny=30, lx=3.0, ly=3.0, k=100, mass=1.0, pulse=0.1, dt=0.005, **kwargs):
+    sim = Simulation(dt=dt, **kwargs)
+    dx, dy = lx / nx, ly / ny
+    movable = ~grid_border((nx, ny))
+    sim.add_particles(mass, grid((nx, ny), (dx, dy), (-lx / 2, -ly / 2, 0.0)), movable=movable)
+    i, j = grid_edges((nx, ny))
+    keep = movable[i] | movable[j]  # no springs along the clamped border
+    sim.add_springs(i[keep], j[keep], k, np.where(j[keep] - i[keep] == 1, dy, dx) * 0.1)
+    sim.state.pos[ny * (nx // 2) + ny // 2, 2] = pulse
+    return sim
+
+# Heavy central charge with two light counter-charges (coulomb_force.py)
+def coulomb_three_body(k=0.5, dt=0.00001, **kwargs):
+    sim = Simulation(dt=dt, **kwargs)
+    sim.add_batch_field(Coulomb(k=k))
+    sim.add_property('charge')
+    sim.add_particle(5.0, (0.0, 0.0, 0.0), properties={'charge': 10.0})
+    sim.add_particle(1.0, (3.0, -1.0, 0.0), (-0.5, 1.0, 0.0), properties={'charge': -0.5})
+    sim.add_particle(1.0, (3.0, 1.0, 0.0), (-0.5, -1.0, 0.0), properties={'charge': -0.5})
+    return sim
+
+# Spinning rotor on a fixed pivot under gravity (gyroscope.py). With rods=True
+# the stiff springs are replaced by rigid rods.
+def gyroscope(k=1_000_000, v_rot=30.0, mass=1.0, l1=3.0, l2=1.0, g=9.8, dt=0.00001, rods=False, **kwargs):
+    sim = Simulation(dt=dt, **kwargs)
+    sim.add_batch_field(uniform_field((0.0, 0.0, -g)))
+    p1 = sim.add_particle(mass, (0.0, 0.0, 0.0), movable=False)
+    p2 = sim.add_particle(mass, (l1, 0.0, 0.0))
+    p3 = sim.add_particle(mass, (l1, l2, 0.0), (0.0, 0.0, v_rot))
+    p4 = sim.add_particle(mass, (l1, 0.0, l2), (0.0, -v_rot, 0.0))
+    p5 = sim.add_particle(mass, (l1, -l2, 0.0), (0.0, 0.0, -v_rot))
+    p6 = sim.add_particle(mass, (l1, 0.0, -l2), (0.0, v_rot, 0.0))
+    for a, b in ((p1, p2), (p2, p3), (p2, p4), (p2, p5), (p2, p6), (p3, p4), (p4, p5),
+                 (p5, p6), (p6, p3), (p1, p3), (p1, p4), (p1, p5), (p1, p6)):
+        if rods:
+            sim.add_rod(a, b)
+        else:
+            sim.add_spring(a, b, k)
+    return sim
+
+# Free body with three distinct principal moments spun about the
+# intermediate axis (dzhanibekov.py). With rods=True the stiff springs are
+# replaced by rigid rods.
+def dzhanibekov(k=1_000_000, d1=1.0, d2=1.0, m1=1.0, m2=2.0, v_z=10.0, dv_xy=0.001, dt=0.00005, rods=False, **kwargs):
+    sim = Simulation(dt=dt, **kwargs)
+    p1 = sim.add_particle(m1, (0.0, 0.0, 0.0))
+    p2 = sim.add_particle(m1, (d1, 0.0, 0.0))
+    p3 = sim.add_particle(m1, (-d1, 0.0, 0.0))
+    p4 = sim.add_particle(m2, (0.0, d2, 0.0), (dv_xy, dv_xy, v_z))
+    p5 = sim.add_particle(m2, (0.0, -d2, 0.0), (-dv_xy, -dv_xy, -v_z))
+    for a, b in ((p1, p2), (p1, p3), (p1, p4), (p1, p5), (p2, p4), (p3, p4), (p2, p5),
+                 (p3, p5), (p2, p3), (p4, p5)):
+        if rods:
+            sim.add_rod(a, b)
+        else:
+            sim.add_spring(a, b, k)
+    return sim
+
+# Damped 3x3x3 lattice with one corner-face particle kicked (cube_vibration.py)
+def cube_lattice(k=500.0, mass=1.0, init_v=3.0, dt=0.0003, damping=True, **kwargs):
+    sim = Simulation(dt=dt, damping=damping, **kwargs)
+    pos = grid((3, 3, 3), 1.0, (-1.0, -1.0, -1.0))
+    sim.add_particles(mass, pos)
+    sim.state.vel[4] = (init_v, 0.0, 0.0)  # the particle at (-1, 0, 0)
+    sim.add_springs(*spring_network(pos, np.sqrt(2)), k)
+    return sim
+
+# Self-gravitating cluster of n equal masses, uniform in a unit sphere with
+# small random velocities (for scaled N-body runs; not one of the examples)
+def nbody_cluster(n=1000, G=1.0, softening=0.05, dt=0.001, seed=0, **kwargs):
+    sim = Simulation(dt=dt, **kwargs)
+    sim.add_batch_field(Gravity(G, softening=softening))
+    rng = np.random.default_rng(seed)
+    direction = rng.normal(size=(n, 3))
+    direction /= np.linalg.norm(direction, axis=1)[:, None]
+    pos = direction * np.cbrt(rng.random(n))[:, None]
+    vel = rng.normal(scale=0.3 * np.sqrt(G), size=(n, 3))
+    sim.add_particles(1.0 / n, pos, vel - vel.mean(0))
+    return sim
+
+SCENES = {
+    'wave': wave_grid,
+    'coulomb': coulomb_three_body,
+    'gyroscope': gyroscope,
+    'dzhanibekov': dzhanibekov,
+    'cube': cube_lattice,
+    'nbody': nbody_cluster,
+}
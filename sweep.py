@@ -0,0 +1,134 @@
+import json
+import os
+from itertools import product
+from multiprocessing import Pool
+import numpy as np
+from numpy.lib.format import open_memmap
+
+# Parameter sweeps over independent simulations spread across a process pool.
+# Every case is built by calling builder(**params), run headless until time t
+# and sampled about `samples` times at a fixed interval (plus the initial state).
+# Samples are written by the worker straight into memory-mapped .npy files
+#   directory/manifest.json           the list of parameter dicts
+#   directory/case-00000/time.npy     (rows,)
+#                        pos.npy      (rows, N, 3)   (and vel.npy)
+#                        energy.npy   (rows, 2)      kinetic, potential
+#                        <name>.npy   (rows, ...)    observables[name](sim)
+#                        done         written once the case has finished
+# so nothing but the case index travels back through the pool. Re-running a
+# sweep on the same directory skips the finished cases.
+
+# A dict of lists is expanded to all combinations; a list of dicts is used as is
+def grid_cases(grid):
+    if isinstance(grid, dict):
+        names = list(grid)
+        return [dict(zip(names, values)) for values in product(*grid.values())]
+    return [dict(case) for case in grid]
+
+def case_directory(directory, index):
+    return os.path.join(directory, f'case-{index:05d}')
+
+def run_case(builder, params, t, samples, path, record=('pos', 'energy'), observables=None):
+    sim = builder(**params)
+    observables = observables or {}
+    getters = {
+        'pos': lambda sim: sim.state.pos,
+        'vel': lambda sim: sim.state.vel,
+        'energy': lambda sim: sim.get_energy(),
+    }
+    getters = {name: getters[name] for name in record}
+    getters.update(observables)
+    # With a fixed dt the samples fall on whole steps, every round(n / samples)
+    if sim.adaptive is None:
+        n_steps = max(0, int(np.ceil((t - sim.time) / sim.dt - 1e-9)))
+        every = max(1, int(round(n_steps / samples)))
+        rows = n_steps // every + 1
+        run = lambda: sim.run_until(t, sample, every)
+    else:
+        rows = samples + 1
+        run = lambda: sim.run_until(t, sample, interval=(t - sim.time) / samples)
+    os.makedirs(path, exist_ok=True)
+    outputs = {'time': open_memmap(os.path.join(path, 'time.npy'), 'w+', float, (rows,))}
+    for name, getter in getters.items():
+        value = np.asarray(getter(sim), float)
+        outputs[name] = open_memmap(os.path.join(path, f'{name}.npy'), 'w+', float, (rows,) + value.shape)
+    row = 0
+
+    def sample(sim):
+        nonlocal row
+        if row < rows:
+            outputs['time'][row] = sim.time
+            for name, getter in getters.items():
+                outputs[name][row] = getter(sim)
+            row += 1
+
+    sample(sim)
+    run()
+    # The final state, should the last output time have been missed
+    if row < rows and sim.time > outputs['time'][row - 1]:
+        sample(sim)
+    for out in outputs.values():
+        out[row:] = np.nan
+        out.flush()
+    with open(os.path.join(path, 'done'), 'w') as f:
+        f.write(str(row))
+
+def _run_case(args):
+    builder, params, t, samples, path, record, observables = args
+    run_case(builder, params, t, samples, path, record, observables)
+    return path
+
+# Runs every case of `grid` not finished yet in `directory` and returns the
+# results of all of them (see load). builder and the observables must be
+# picklable, i.e. module-level functions. progress(finished, total) is called
+# as cases complete; processes=1 runs them in this process.
+def sweep(builder, grid, t, samples=100, directory='sweep', record=('pos', 'energy'), observables=None,
+          processes=None, progress=None):
+    cases = grid_cases(grid)
+    os.makedirs(directory, exist_ok=True)
+    manifest = os.path.join(directory, 'manifest.json')
+    described = json.loads(json.dumps(cases, default=repr))
+    if os.path.exists(manifest):
+        with open(manifest) as f:
+            if json.load(f) != described:
+                raise ValueError(f"{directory!r} holds a different sweep")
+    else:
+        with open(manifest, 'w') as f:
+            json.dump(described, f, indent=1)
+    paths = [case_directory(directory, index) for index in range(len(cases))]
+    todo = [(builder, params, t, samples, path, record, observables)
+            for params, path in zip(cases, paths) if not os.path.exists(os.path.join(path, 'done'))]
+    finished = len(cases) - len(todo)
+    if progress is not None:
+        progress(finished, len(cases))
+
+    def report(_):
+        nonlocal finished
+        finished += 1
+        if progress is not None:
+            progress(finished, len(cases))
+
+    if processes == 1:
+        for args in todo:
+            report(_run_case(args))
+    else:
+        with Pool(processes) as pool:
+            for path in pool.imap_unordered(_run_case, todo):
+                report(path)
+    return load(directory)
+
+# The sweep in `directory` as a list of (params, arrays) pairs, with the arrays
+# of each finished case opened read-only as memory maps (None for unfinished
+# cases). Rows past the last sample of a case are NaN.
+def load(directory):
+    with open(os.path.join(directory, 'manifest.json')) as f:
+        cases = json.load(f)
+    results = []
+    for index, params in enumerate(cases):
+        path = case_directory(directory, index)
+        arrays = None
+        if os.path.exists(os.path.join(path, 'done')):
+            arrays = {name[:-4]: np.load(os.path.join(path, name), mmap_mode='r')
+                      for name in sorted(os.listdir(path)) if name.endswith('.npy')}
+        results.append((params, arrays))
+    return results
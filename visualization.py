@@ -1,32 +1,240 @@
 from vpython import *
 from math import cbrt
+import threading
+import numpy as np
+from recorder import Trajectory
 
 # Convert a (x,y,z) vector to the (x,z,y) VPython vector
 pvec = lambda v: vec(v[0],v[2],v[1])
 
+# Triple-buffered position snapshots passed from a physics thread to a render
+# loop. post() copies into a spare buffer and swaps it in as the latest one,
+# take() swaps the latest one out for reading, so neither side waits for the
+# other beyond a pointer swap. Snapshots posted faster than they are taken are
+# dropped (posted - taken).
+class Snapshots:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buffers = [None, None, None]
+        self.write, self.ready, self.read = 0, 1, 2
+        self.fresh = False
+        self.posted = 0
+        self.taken = 0
+
+    def post(self, pos):
+        buffer = self.buffers[self.write]
+        if buffer is None or buffer.shape != pos.shape:
+            buffer = self.buffers[self.write] = np.empty_like(pos)
+        np.copyto(buffer, pos)
+        with self.lock:
+            self.write, self.ready = self.ready, self.write
+            self.fresh = True
+        self.posted += 1
+
+    # The newest snapshot not taken yet, or None
+    def take(self):
+        with self.lock:
+            if not self.fresh:
+                return None
+            self.read, self.ready = self.ready, self.read
+            self.fresh = False
+        self.taken += 1
+        return self.buffers[self.read]
+
 class Visualization:
     def __init__(self, simulation, resolution, sphere_color, sphere_radius, spring_color, spring_radius):
+        self.simulation = simulation
+        self.version = simulation.topology_version
+        state = simulation.state
+        i = np.concatenate((simulation.spring_state.i, simulation.rod_state.i))
+        j = np.concatenate((simulation.spring_state.j, simulation.rod_state.j))
+        self._build(resolution, state.mass, state.pos, i, j, sphere_color, sphere_radius, spring_color, spring_radius)
+
+    # One sphere per particle and one cylinder per spring or rod (i[k], j[k])
+    def _build(self, resolution, mass, pos, i, j, sphere_color, sphere_radius, spring_color, spring_radius):
         canvas(width=resolution[0], height=resolution[1])
 
-        self.simulation = simulation
+        self.sphere_color = sphere_color
+        self.sphere_radius = sphere_radius
+        self.spring_color = spring_color
+        self.spring_radius = spring_radius
+        self.mass = np.array(mass)
+        self.i = np.array(i, int)
+        self.j = np.array(j, int)
+        self.stale = np.zeros(len(self.i), bool)
+        self.drawn = np.array(pos)
+        self.snapshots = Snapshots()
         self.particles = []
         self.springs = []
 
-        for particle in simulation.particles:
-            p = sphere(color=sphere_color, radius=sphere_radius*cbrt(particle.mass), pos=pvec(particle.pos))
-            self.particles.append(p)
+        for m, p in zip(mass, pos):
+            s = sphere(color=sphere_color, radius=sphere_radius*cbrt(m), pos=pvec(p))
+            self.particles.append(s)
 
-        for spring in simulation.springs:
-            axis = spring.p2.pos - spring.p1.pos
-            pos = spring.p1.pos
-            s = cylinder(pos=pvec(pos), axis=pvec(axis), radius=spring_radius, color=spring_color)
+        for a, b in zip(pos[self.i], pos[self.j]):
+            s = cylinder(pos=pvec(a), axis=pvec(b - a), radius=spring_radius, color=spring_color)
             self.springs.append(s)
 
+    # Switches to new particle masses and spring / rod pairs: spheres and
+    # cylinders are added or hidden to match, and the next draw moves the ones
+    # whose particle or endpoints changed
+    def set_topology(self, mass, i, j):
+        mass, i, j = np.asarray(mass, float), np.asarray(i, int), np.asarray(j, int)
+        n, s = min(len(mass), len(self.mass)), min(len(i), len(self.i))
+        while len(self.particles) > len(mass):
+            self.particles.pop().visible = False
+        while len(self.particles) < len(mass):
+            self.particles.append(sphere(color=self.sphere_color, radius=self.sphere_radius, pos=vec(0, 0, 0)))
+        changed = np.ones(len(mass), bool)
+        changed[:n] = mass[:n] != self.mass[:n]
+        for k in np.flatnonzero(changed).tolist():
+            self.particles[k].radius = self.sphere_radius * cbrt(mass[k])
+        while len(self.springs) > len(i):
+            self.springs.pop().visible = False
+        while len(self.springs) < len(i):
+            self.springs.append(cylinder(pos=vec(0, 0, 0), axis=vec(1, 0, 0), radius=self.spring_radius,
+                                         color=self.spring_color))
+        self.stale = np.ones(len(i), bool)
+        self.stale[:s] = (i[:s] != self.i[:s]) | (j[:s] != self.j[:s])
+        # Rows without a drawn position (new particles) count as moved
+        drawn = np.full((len(mass), 3), np.nan)
+        drawn[:n] = self.drawn[:n]
+        self.mass, self.i, self.j, self.drawn = mass, i, j, drawn
+
+    # Re-reads the simulation's particles, springs and rods if springs broke
+    # or anything was removed since the last draw
+    def follow(self):
+        sim = self.simulation
+        if sim.topology_version != self.version:
+            self.version = sim.topology_version
+            self.set_topology(sim.state.mass, np.concatenate((sim.spring_state.i, sim.rod_state.i)),
+                              np.concatenate((sim.spring_state.j, sim.rod_state.j)))
+
+    # Moves the objects to `pos`, skipping the particles that have not moved
+    # since the last draw and the springs between them
+    def draw(self, pos):
+        if pos.shape == self.drawn.shape:
+            moved = np.any(pos != self.drawn, axis=1)
+        else:
+            moved = np.ones(len(pos), bool)
+        coords = pos[:, [0, 2, 1]]
+
+        idx = np.flatnonzero(moved)
+        for k, (x, y, z) in zip(idx.tolist(), coords[idx].tolist()):
+            self.particles[k].pos = vec(x, y, z)
+
+        idx = np.flatnonzero(moved[self.i] | moved[self.j] | self.stale)
+        start = coords[self.i[idx]]
+        axis = coords[self.j[idx]] - start
+        for k, a, d in zip(idx.tolist(), start.tolist(), axis.tolist()):
+            self.springs[k].pos = vec(*a)
+            self.springs[k].axis = vec(*d)
+
+        self.drawn = pos.copy()
+        self.stale[:] = False
+
     def update(self):
-        for vp,sp in zip(self.particles, self.simulation.particles):
-            vp.pos = pvec(sp.pos)
+        self.follow()
+        self.draw(self.simulation.state.pos)
+
+    # Threaded mode: the physics thread calls post() to publish the current
+    # positions (it never blocks, so it can be passed as a run() callback), and
+    # render() draws the latest posted snapshot if there is a new one
+    def post(self, sim=None):
+        self.snapshots.post(self.simulation.state.pos)
+
+    def render(self):
+        pos = self.snapshots.take()
+        if pos is not None:
+            self.follow()
+            # A snapshot from before particles were added or removed is skipped
+            if len(pos) == len(self.particles):
+                self.draw(pos)
+
+    # Runs physics() (which steps the simulation and posts snapshots) in a
+    # background thread and renders at `fps` until it returns
+    def start(self, physics, fps=30):
+        thread = threading.Thread(target=physics, daemon=True)
+        thread.start()
+        while thread.is_alive():
+            rate(fps)
+            self.render()
+        self.render()
+
+# Plays back a run recorded with recorder.TrajectoryRecorder (a Trajectory or
+# its directory) without a Simulation. The masses and the spring / rod pairs
+# come from the recording unless given (pairs as an (S, 2) array), following
+# the topology of every frame if springs or rods were removed while recording.
+# A slider scrubs through the frames and a button pauses playback.
+class Replay(Visualization):
+    def __init__(self, trajectory, resolution, sphere_color, sphere_radius, spring_color, spring_radius,
+                 pairs=None, mass=None):
+        if isinstance(trajectory, str):
+            trajectory = Trajectory(trajectory)
+        self.trajectory = trajectory
+        self.times = trajectory.read('time')
+        self.fixed_mass = mass
+        self.fixed_pairs = pairs
+        self.change = 0
+        pos = trajectory.read('pos', 0, 1)[0]
+        mass, i, j = self.topology(0, len(pos))
+        self._build(resolution, mass, pos, i, j, sphere_color, sphere_radius, spring_color, spring_radius)
+
+        self.frame = 0
+        self.time = self.times[0]
+        self.paused = False
+        self.slider = slider(min=0, max=max(len(self.times) - 1, 1), step=1, value=0, length=resolution[0] // 2,
+                             bind=lambda s: self.seek(int(s.value)))
+        self.label = wtext(text='')
+        button(text='Pause', bind=self.toggle)
+        self.show(0)
+
+    # Masses and pairs (i, j) of the n particles in effect at `frame`
+    def topology(self, frame, n):
+        topology = self.trajectory.topology_at(frame) or {}
+        mass = self.fixed_mass
+        if mass is None:
+            mass = topology.get('mass', np.ones(n))
+        if self.fixed_pairs is None:
+            i = np.concatenate((topology.get('spring_i', []), topology.get('rod_i', []))).astype(int)
+            j = np.concatenate((topology.get('spring_j', []), topology.get('rod_j', []))).astype(int)
+        else:
+            i, j = np.asarray(self.fixed_pairs, int).reshape(-1, 2).T
+        return mass, i, j
+
+    def show(self, frame):
+        self.frame = frame
+        change = max([f for f in self.trajectory.changes if f <= frame], default=0)
+        if change != self.change:
+            mass, i, j = self.topology(frame, len(self.particles))
+            self.set_topology(mass, i, j)
+            self.change = change
+        self.draw(self.trajectory.read('pos', frame, frame + 1)[0])
+        self.slider.value = frame
+        self.label.text = f' t = {self.times[frame]:.4f}'
+
+    # Jumps to a frame; playback continues from there
+    def seek(self, frame):
+        self.time = self.times[frame]
+        self.show(frame)
+
+    def toggle(self, b):
+        self.paused = not self.paused
+        b.text = 'Play' if self.paused else 'Pause'
 
-        for vs,ss in zip(self.springs, self.simulation.springs):
-            dif = ss.p2.pos - ss.p1.pos
-            vs.pos = pvec(ss.p1.pos)
-            vs.axis = pvec(dif)
+    # Plays `speed` simulated seconds per second of wall-clock time, drawing at
+    # most `fps` frames per second; with loop=True it starts over at the end
+    def play(self, speed=1.0, loop=False, fps=30):
+        while True:
+            rate(fps)
+            if self.paused:
+                continue
+            self.time += speed / fps
+            if self.time > self.times[-1]:
+                if not loop:
+                    self.show(len(self.times) - 1)
+                    return
+                self.time = self.times[0]
+            frame = int(np.searchsorted(self.times, self.time, 'right')) - 1
+            if frame != self.frame:
+                self.show(frame)